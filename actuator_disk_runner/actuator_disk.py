@@ -5,7 +5,7 @@ import sys
 from pathlib import Path    
 import shutil
 import xml.etree.ElementTree as ET
-from typing import List
+from typing import List, Tuple
 import itertools
 from pprint import pprint
 import os
@@ -28,14 +28,14 @@ class Project():
 
 # Defining the Actuator disk class
 class ActuatorDiskRunner:
-    def __init__(self, project_path: Path=Path('C:/Users/GullikKillie/Documents/WindSim Projects 12/Actuator_Disk_Flat/Actuator_Disk_Flat_base/Actuator_Disk_Flat.ws'), windsim=Path('C:/Program Files/WindSim/WindSim 12.0.0'), environment=Path('C:/Users/GullikKillie/AppData/Roaming/WindSim/1200/Environment.xml'), owsfile: str='AD_layout', layout='Layout 1.lws'):
+    def __init__(self, project_path: Path=Path('C:/Users/GullikKillie/Documents/WindSim Projects 12/Actuator_Disk_Flat/Actuator_Disk_Flat_base/Actuator_Disk_Flat.ws'), windsim=Path('C:/Program Files/WindSim/WindSim 12.0.0'), environment=Path('C:/Users/GullikKillie/AppData/Roaming/WindSim/1200/Environment.xml'), owsfile: str='AD_layout', layout='Layout 1.lws', catalog=None):
+        """ catalog: optional, a visualizations.readers.catalog.Catalog that has the sectors and threads of the project already """
         self.project = Project(project_path=project_path, layout=layout)
         self.owsfile = owsfile
         self.project_names = []
         self.windsim = windsim
         self.environment = environment
-        self.sectors = self._get_sectors()
-        self.threads = self._get_threads()
+        self.sectors, self.threads = self._get_sectors_and_threads(catalog)
 
     def setup_AD(self, windspeeds: List[float] = [7, 20], AD_spacings: int=16):
         """ Creates projects and necessary files to run the actuator disks"""
@@ -54,27 +54,20 @@ class ActuatorDiskRunner:
         return
     
 
-    def _get_sectors(self) -> List[float]:
-        """ Read the project file and the number of sectors to run for the projects """
-        ET.register_namespace('', 'ProjectParameters.xsd')
-        tree = ET.parse(self.project.project_file)
-        root = tree.getroot()
-        sectors = []
-        for sector_element in root.iter('{ProjectParameters.xsd}Sector'):
-            sectors.append(sector_element.text)
+    def _get_sectors_and_threads(self, catalog=None) -> Tuple[List[str], str]:
+        """ The sectors to run and the number of simultaneous simulations, from the catalog or by reading the project file once """
+        entry = catalog.project(self.project.project_file) if catalog is not None else None
+        if entry is not None:
+            return entry['sectors'], str(entry['parallel_cores'])
 
-        return sectors
-    
-    def _get_threads(self) -> int:
-        """ Read the project file and the number of simultaneous simulations to run for the projects """
         ET.register_namespace('', 'ProjectParameters.xsd')
-        tree = ET.parse(self.project.project_file)
-        root = tree.getroot()
-        threads = 1
+        root = ET.parse(self.project.project_file).getroot()
+        sectors = [sector_element.text for sector_element in root.iter('{ProjectParameters.xsd}Sector')]
+        threads = '1'
         for threads_element in root.iter('{ProjectParameters.xsd}ParallelCores'):
             threads = threads_element.text
 
-        return threads
+        return sectors, threads
 
     
     def _replace_or_add_element(self, namespace, field: ET.Element, parameter: str, value: any):
@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+
+"""batch_mode.py: Runs WindSim projects in batch, the module behind the batch-mode notebooks.
+
+* WindSimRunner copies a project for several boundary layer windspeeds and runs Terrain and WindFields, with the sectors in parallel.
+* LayoutCreator makes a layout for every climatology and runs Objects and WindResources for them, with the layouts in parallel.
+
+The executables are run by a BatchExecutor, a bounded pool where every job has its own working directory and can be cancelled.
+Which executable is run is decided by the solver, WindSimSolver runs the modules of a WindSim installation
+while LocalSolver runs a stand-in executable, for instance to check the throughput of the pool on Linux.
+
+Example:
+    python batch_mode.py windresources --project 'C:/Users/<user>/Documents/WindSim Projects 12/Hundhammer/Hundhammer.ws' --layout 'Layout 1' --climatologies Hundhammer_30m:30 Hundhammer_73m:73 --windsim 'C:/Program Files/WindSim/WindSim 12.0.0' --environment 'C:/Users/<user>/AppData/Roaming/WindSim/1200/Environment.xml' --workers 4
+"""
+import sys
+from pathlib import Path
+import shutil
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Optional, Tuple
+import datetime
+import itertools
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+
+
+if sys.version_info < (3,8):
+    print(f"Python version is {sys.version_info}, needs to be 3.9 or newer.")
+    sys.exit()
+
+def layout_stem(layout: str) -> str:
+    """ The name of a layout without the .lws suffix, 'Layout 1' for both 'Layout 1' and 'Layout 1.lws' """
+    return layout[:-len('.lws')] if layout.lower().endswith('.lws') else layout
+
+
+# Defining the project we want to work with
+class Project():
+    def __init__(self, project_path: Path, layout: str="Layout 1.lws"):
+        """ layout: with or without the .lws suffix, layout is the file name the modules get and layout_name the name of the layout folder """
+        self.name = project_path.stem
+        self.project_file = project_path
+        self.layout_name = layout_stem(layout)
+        self.layout = f'{self.layout_name}.lws'
+        self.base_directory = self.project_file.parent.parent
+
+
+class WindSimSolver:
+    """ Command lines for the modules of a WindSim installation """
+    def __init__(self, windsim: Path, environment: Path):
+        self.windsim = windsim
+        self.environment = environment
+
+    def command(self, module: str, project_file: Path, layout: str, *extra: str) -> List[str]:
+        return [str(self.windsim / 'bin' / f'{module}.exe'), str(project_file), layout, str(self.environment), *extra]
+
+
+class LocalSolver(WindSimSolver):
+    """ Runs a stand-in executable instead of the WindSim modules, with the module name as the first argument """
+    def __init__(self, executable: Path, environment: Path=Path('Environment.xml')):
+        super().__init__(windsim=executable.parent, environment=environment)
+        self.executable = executable
+
+    def command(self, module: str, project_file: Path, layout: str, *extra: str) -> List[str]:
+        return [str(self.executable), module, str(project_file), layout, str(self.environment), *extra]
+
+
+class JobResult:
+    def __init__(self, name: str, returncode: Optional[int], stdout: str='', stderr: str='', duration: float=0, cancelled: bool=False):
+        self.name = name
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.cancelled = cancelled
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.cancelled
+
+    def __repr__(self) -> str:
+        return f'JobResult({self.name!r}, returncode={self.returncode}, duration={self.duration:.1f}s, cancelled={self.cancelled})'
+
+
+class BatchExecutor:
+    def __init__(self, max_workers: int=1, work_root: Optional[Path]=None, stagger: float=0):
+        """
+        max_workers: the number of jobs running at the same time
+        work_root: where the working directories of the jobs are made, default is the temp directory
+        stagger: minimum number of seconds between the start of two jobs
+        """
+        self.max_workers = max_workers
+        self.work_root = work_root
+        self.stagger = stagger
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: List[Future] = []
+        # by job id, names given to submit need not be unique
+        self._processes: Dict[int, subprocess.Popen] = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._last_start = 0.0
+        self._cancelled = threading.Event()
+
+    def __enter__(self) -> 'BatchExecutor':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None:
+            self.cancel()
+        self._pool.shutdown(wait=True)
+
+    def submit(self, name: str, commands: List[List[str]], callback: Optional[Callable[[JobResult], None]]=None) -> Future:
+        """ Runs the commands one after another in a working directory of their own. The callback gets the JobResult when the job is done """
+        future = self._pool.submit(self._run, name, commands, next(self._job_ids))
+        if callback is not None:
+            future.add_done_callback(lambda f: None if f.cancelled() else callback(f.result()))
+        self._futures.append(future)
+        return future
+
+    def _wait_for_stagger(self) -> None:
+        # Reserve the next start time, the sleep is outside the lock so cancel() is not blocked
+        with self._lock:
+            start = max(time.monotonic(), self._last_start + self.stagger)
+            self._last_start = start
+        time.sleep(max(0, start - time.monotonic()))
+
+    def _run(self, name: str, commands: List[List[str]], job_id: int) -> JobResult:
+        start = time.monotonic()
+        stdout, stderr = [], []
+        returncode: Optional[int] = None
+        self._wait_for_stagger()
+        if self._cancelled.is_set():
+            return JobResult(name, None, cancelled=True)
+
+        workdir = tempfile.mkdtemp(prefix='windsim_', dir=self.work_root)
+        try:
+            for command in commands:
+                with self._lock:
+                    if self._cancelled.is_set():
+                        break
+                    try:
+                        process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+                    except OSError as error:
+                        # i.e. a wrong path to the executable, the job fails but the rest of the batch runs
+                        print(f'{name} could not start {command[0]}: {error}')
+                        stderr.append(str(error))
+                        returncode = None
+                        break
+                    self._processes[job_id] = process
+                out, err = process.communicate()
+                with self._lock:
+                    del self._processes[job_id]
+                stdout.append(out)
+                stderr.append(err)
+                returncode = process.returncode
+                if returncode != 0:
+                    if not self._cancelled.is_set():
+                        print(f'{name} failed with return code {returncode}: {err}')
+                    break
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        return JobResult(name, returncode, ''.join(stdout), ''.join(stderr), time.monotonic() - start, cancelled=self._cancelled.is_set())
+
+    def cancel(self) -> None:
+        """ Cancels the jobs that have not started and terminates the running ones """
+        self._cancelled.set()
+        for future in self._futures:
+            future.cancel()
+        with self._lock:
+            for process in self._processes.values():
+                process.terminate()
+
+    def wait(self) -> List[JobResult]:
+        """ Waits for all submitted jobs, a KeyboardInterrupt cancels the remaining jobs """
+        results = []
+        try:
+            for future in as_completed(list(self._futures)):
+                if not future.cancelled():
+                    results.append(future.result())
+        except KeyboardInterrupt:
+            print('Cancelling the remaining jobs')
+            self.cancel()
+            raise
+        finally:
+            self._futures = [future for future in self._futures if not future.done()]
+        return results
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+# Defining the WindSimRunner class
+class WindSimRunner:
+    def __init__(self, project_path: Path, environment: Path, layout: str, windsim=Path('C:/Program Files/WindSim/WindSim 12.0.0'), solver: Optional[WindSimSolver]=None, catalog=None) :
+        """ catalog: optional, a visualizations.readers.catalog.Catalog that has the sectors and threads of the project already """
+        self.project = Project(project_path=project_path, layout=layout)
+        self.project_names = []
+        self.windsim = windsim
+        self.environment = environment
+        self.solver = solver or WindSimSolver(windsim=windsim, environment=environment)
+        self.sectors, self.threads = self._get_sectors_and_threads(catalog)
+
+
+    def _get_sectors_and_threads(self, catalog=None) -> Tuple[List[str], int]:
+        """ The sectors to run and the number of simultaneous simulations, from the catalog or by reading the project file once """
+        entry = catalog.project(self.project.project_file) if catalog is not None else None
+        if entry is not None:
+            return entry['sectors'], int(entry['parallel_cores'])
+
+        ET.register_namespace('', 'ProjectParameters.xsd')
+        root = ET.parse(self.project.project_file).getroot()
+        sectors = [sector_element.text for sector_element in root.iter('{ProjectParameters.xsd}Sector')]
+        threads = 1
+        for threads_element in root.iter('{ProjectParameters.xsd}ParallelCores'):
+            threads = int(threads_element.text)
+
+        return sectors, threads
+
+
+    def _replace_or_add_element(self, namespace, field: ET.Element, parameter: str, value: any):
+        # This may or may not be available
+        parameter_present = False
+        for child in field.findall("{ProjectParameters.xsd}"+parameter, namespace):
+            parameter_present = True
+            child.text = str(value)
+        if not parameter_present:
+            ows_element = ET.SubElement(field, parameter)
+            ows_element.text = str(value)
+
+    def setup_project(self, windspeeds: List[float] = [7, 20]):
+        """ Creates projects and necessary files to run the actuator disks"""
+
+        for windspeed in  windspeeds:
+            print(f'Setting up {self.project.name} with Windspeed {windspeed}')
+            copy_name = self.copy_project(windspeed=windspeed)
+            self.project_names.append(copy_name)
+
+        return
+
+
+    def copy_project(self, windspeed: float = 7) -> str:
+        """Copies a project with different settings given by the input"""
+
+        copy_name = f'{self.project.name}_windspeed_{windspeed}'
+        print(f"Making {copy_name} from base {self.project.name}")
+        base_dir = self.project.project_file.parent
+        dest_dir = self.project.base_directory / copy_name
+
+        shutil.copytree(base_dir, dest_dir, dirs_exist_ok=True)
+
+        #Changing the Number of nodes and cells in the project
+        ET.register_namespace('', 'ProjectParameters.xsd')
+        tree = ET.parse(dest_dir  / f"{self.project.name}.ws")
+        root = tree.getroot()
+
+        namespace = {'project_parameters': 'ProjectParameters.xsd'}
+
+        for WindFields in root.findall("{ProjectParameters.xsd}WindField"):
+            self._replace_or_add_element(namespace, WindFields, "VelocityBoundaryLayer", windspeed)
+
+        ET.indent(tree, '  ')
+        tree.write(dest_dir  / f"{self.project.name}.ws", encoding = "UTF-8",  xml_declaration=True)
+
+        project_file = dest_dir  / f"{self.project.name}.ws"
+        project_file.replace(f'{dest_dir / copy_name}.ws')
+
+        return copy_name
+
+    def _project_file(self, name: str) -> Path:
+        return self.project.base_directory / name / f'{name}.ws'
+
+    def run_Terrains(self, max_workers: int=1):
+        # The projects are independent, so they can run at the same time
+        with BatchExecutor(max_workers=max_workers) as executor:
+            for project_name in self.project_names:
+                print(f'Run Terrain and Report[Terrain] for {project_name}')
+                executor.submit(project_name, [
+                    self.solver.command('Terrain', self._project_file(project_name), self.project.layout),
+                    self.solver.command('Reports', self._project_file(project_name), self.project.layout, '1'),
+                ])
+            results = executor.wait()
+
+        print("Finished running Terrain")
+        return results
+
+    def run_WindFields(self, on_sector_done: Optional[Callable[[str, str, JobResult], None]]=None):
+        # Then run the projects
+        results = []
+        for project_name in self.project_names:
+            results.extend(self.run_WindField(project_name, on_sector_done=on_sector_done))
+
+        print("Finished running WindFields")
+        return results
+
+    def run_WindField(self, name: str, max_workers: Optional[int]=None, stagger: float=10, on_sector_done: Optional[Callable[[str, str, JobResult], None]]=None) -> List[JobResult]:
+        """
+        Runs the sectors of a project in parallel, by default as many as ParallelCores in the project file.
+        on_sector_done(project name, sector, result) is called as soon as a sector has finished.
+        """
+        with BatchExecutor(max_workers=max_workers or self.threads, stagger=stagger) as executor:
+            for sector_count, sector in enumerate(self.sectors, start=1):
+                print(f'Running WindFields for {name}, sector: {sector}')
+                callback = None
+                if on_sector_done is not None:
+                    callback = lambda result, sector=sector: on_sector_done(name, sector, result)
+                executor.submit(f'{name} sector {sector}', [self.solver.command('WindFields', self._project_file(name), self.project.layout, f'/si{sector_count}')], callback=callback)
+            results = executor.wait()
+
+        for result in results:
+            if not result.ok:
+                print(f"Windfield Error {result.name}: ", result.stderr)
+
+        print(f'Running Report[WindFields] for {name}')
+        with BatchExecutor() as executor:
+            executor.submit(f'{name} report', [self.solver.command('Reports', self._project_file(name), self.project.layout, '2')])
+            executor.wait()
+        return results
+
+
+class LayoutCreator:
+    def __init__(self, project: Project, climatologies: List[Dict[str,int]], windsim: Path, environment: Path, solver: Optional[WindSimSolver]=None) :
+        self.project = project
+        self.climatologies = climatologies
+        self.windsim = windsim
+        self.environment =environment
+        self.solver = solver or WindSimSolver(windsim=windsim, environment=environment)
+
+
+    def _copy_layout(self, climatology: str, layout: Optional[str]=None) -> None:
+        """Copies a layout, layout folder and layout-file, this requires a layout to be present"""
+
+        original_layout =self.project.project_file.parent / layout_stem(layout or self.project.layout_name)
+        new_layout =self.project.project_file.parent / climatology
+        print(f"Making new layout {climatology} using climatology {climatology}, in project {self.project.project_file.parent}")
+
+        #Copy folder
+        shutil.copytree(src=original_layout, dst=new_layout, dirs_exist_ok=True)
+
+        # Copy layout-file
+        shutil.copy(src=original_layout.with_suffix('.lws'), dst= new_layout.with_suffix('.lws'))
+
+        # Add entry in layoutlist
+        self._add_layout_entry(climatology=climatology)
+
+        return
+
+    @staticmethod
+    def layout_name(climatology: Dict[str,int], layout: Optional[str]=None) -> str:
+        """ The name of the layout made for a climatology, prefixed with the base layout when there are several """
+        return climatology['name'] if layout is None else f"{layout}_{climatology['name']}"
+
+    def create_layouts(self, climatologies: List[Dict[str,int]], layouts: Optional[List[str]]=None) -> List[str]:
+        '''
+        For all the climatologies in the list, and all the base layouts if given:
+            * Copy the current layoutfolder, which should contain 1 climatology
+            * Copy the layoutfile
+            * Add entry in LayoutList
+            * Edit the single climatology in layoutfile to correspond to 1 in list
+        '''
+        names = []
+        for layout in ([layout_stem(layout) for layout in layouts] if layouts else [None]):
+            for climatology in climatologies:
+                name = self.layout_name(climatology, layout)
+                self._copy_layout(climatology=name, layout=layout)
+                self._change_climatology(climatology=name, height=climatology['height'], climatology_file=climatology['name'])
+                names.append(name)
+
+        return names
+
+    def _change_climatology(self, climatology:str, height:int, climatology_file: Optional[str]=None):
+        '''Changes the climatology in a layout'''
+        ET.register_namespace('', 'LayoutParameters.xsd')
+        layout_file =(self.project.project_file.parent / climatology).with_suffix('.lws')
+
+        tree = ET.parse(layout_file)
+        root = tree.getroot()
+        namespace = {'layout_parameters': 'LayoutParameters.xsd'}
+
+        for object in root.findall("{LayoutParameters.xsd}Objects"):
+            for objectpoint in object.findall("{LayoutParameters.xsd}ObjectPoint"):
+                self._replace_or_add_element(namespace=namespace, field=objectpoint, parameter='IDText', value=climatology)
+                self._replace_or_add_element(namespace=namespace, field=objectpoint, parameter='Zpos', value=height)
+                self._replace_or_add_element(namespace=namespace, field=objectpoint, parameter='IDhtml', value=climatology)
+                self._replace_or_add_element(namespace=namespace, field=objectpoint, parameter='WecsClimFileName', value=climatology_file or climatology)
+
+        for element in root.findall("{LayoutParameters.xsd}WindResources"):
+                self._replace_or_add_element(namespace=namespace, field=element, parameter='WindResourcesHeight', value=height)
+
+
+
+        ET.indent(tree, '  ')
+        tree.write(layout_file, encoding = "UTF-8",  xml_declaration=True)
+
+        return
+
+    def _add_layout_entry(self, climatology:str):
+        ''' Adds the new entry in the LayoutList'''
+        ET.register_namespace('', 'LayoutList.xsd')
+        tree = ET.parse(self.project.project_file.parent / 'LayoutList.xml')
+        root = tree.getroot()
+        namespace = {'layoutlist_parameters': 'LayoutList.xsd'}
+
+        # Create a new layout element
+        new_layout = ET.Element("Layout")
+        ET.SubElement(new_layout, "Name").text = climatology
+        ET.SubElement(new_layout, "LastOpened").text = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f%z")
+        ET.SubElement(new_layout, "ShortName").text = climatology
+        ET.SubElement(new_layout, "ShortFullPath").text = (self.project.project_file.parent / climatology).with_suffix('.lws').as_posix().replace('/', '\\')
+        # Append the new layout to the root element
+        root.append(new_layout)
+
+        # Save the modified XML file
+        ET.indent(tree, '  ')
+
+        tree.write(self.project.project_file.parent / 'LayoutList_new', encoding="utf-8", xml_declaration=True)
+
+
+        return
+
+    def _replace_or_add_element(self, namespace, field: ET.Element, parameter: str, value: any):
+        # This may or may not be available
+        parameter_present = False
+        for child in field.findall("{LayoutParameters.xsd}"+parameter, namespace):
+            parameter_present = True
+            child.text = str(value)
+        if not parameter_present:
+            ows_element = ET.SubElement(field, parameter)
+            ows_element.text = str(value)
+
+    def _commands(self, name: str, objects: bool, resources: bool) -> List[List[str]]:
+        commands = []
+        if objects:
+            commands.append(self.solver.command('Objects', self.project.project_file, f'{name}.lws'))
+            commands.append(self.solver.command('Reports', self.project.project_file, f'{name}.lws', '3'))
+        if resources:
+            commands.append(self.solver.command('WindResources', self.project.project_file, f'{name}.lws'))
+            commands.append(self.solver.command('Reports', self.project.project_file, f'{name}.lws', '5'))
+        return commands
+
+    def run_layouts(self, names: List[str], objects: bool=True, resources: bool=True, max_workers: int=1) -> List[JobResult]:
+        """ Runs Objects and/or WindResources with their reports for the layouts, max_workers layouts at the same time """
+        with BatchExecutor(max_workers=max_workers) as executor:
+            for name in names:
+                print(f'Run Objects/WindResources for layout {name}')
+                executor.submit(name, self._commands(name, objects, resources))
+            results = executor.wait()
+
+        for result in results:
+            if not result.ok:
+                print(f'Layout {result.name} failed: {result.stderr}')
+        return results
+
+    def run_Object(self, name: str) -> None:
+        self.run_layouts([name], objects=True, resources=False)
+
+    def run_Objects(self, climatologies:List[Dict], max_workers: int=1):
+        return self.run_layouts([self.layout_name(climatology) for climatology in climatologies], objects=True, resources=False, max_workers=max_workers)
+
+    def run_WindResource(self, name: str) -> None:
+        self.run_layouts([name], objects=False, resources=True)
+
+    def run_WindResources(self, climatologies:List[Dict], max_workers: int=1):
+        return self.run_layouts([self.layout_name(climatology) for climatology in climatologies], objects=False, resources=True, max_workers=max_workers)
+
+
+def _climatology(value: str) -> Dict[str,int]:
+    name, height = value.rsplit(':', 1)
+    return {'name': name, 'height': float(height)}
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Running WindSim projects in batch.", epilog="Example: python batch_mode.py windresources --project 'C:/Users/<user>/Documents/WindSim Projects 12/Hundhammer/Hundhammer.ws' --layout 'Layout 1' --climatologies Hundhammer_30m:30 Hundhammer_73m:73 --windsim 'C:/Program Files/WindSim/WindSim 12.0.0' --environment 'C:/Users/<user>/AppData/Roaming/WindSim/1200/Environment.xml'")
+    parser.add_argument('mode', type=str, choices=['windfields', 'windresources'],
+                    help='windfields: copy the project for the windspeeds and run Terrain and WindFields. windresources: make a layout for every climatology and run Objects and WindResources')
+    parser.add_argument('-p', '--project', type=str, required=True, help='Absolute path of the project file.')
+    parser.add_argument('-w', '--windsim', type=str, default='C:/Program Files/WindSim/WindSim 12.0.0', help='Absolute path of the windsim installation')
+    parser.add_argument('-e', '--environment', type=str, required=True, help='Absolute path of the environment file.')
+    parser.add_argument('-l', '--layout',  type=str, nargs='+', required=True, help='Name of the layout(s), with or without the .lws suffix.')
+    parser.add_argument('-c', '--climatologies', type=_climatology, nargs='+', default=[], help='Climatologies as name:height, for windresources.')
+    parser.add_argument('--windspeeds', type=float, nargs='+', default=[7, 20], help='Boundary layer windspeeds, for windfields.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of simultaneous runs')
+    parser.add_argument('--solver', type=str, default=None, help='Stand-in executable to run instead of the WindSim modules, it gets the module name as the first argument.')
+
+    args = parser.parse_args()
+    solver = LocalSolver(Path(args.solver), Path(args.environment)) if args.solver else None
+
+    if args.mode == 'windfields':
+        runner = WindSimRunner(project_path=Path(args.project), windsim=Path(args.windsim), environment=Path(args.environment), layout=args.layout[0], solver=solver)
+        runner.setup_project(windspeeds=args.windspeeds)
+        runner.run_Terrains(max_workers=args.workers)
+        runner.run_WindFields()
+    if args.mode == 'windresources':
+        project = Project(project_path=Path(args.project), layout=args.layout[0])
+        layout_creator = LayoutCreator(project=project, climatologies=args.climatologies, windsim=Path(args.windsim), environment=Path(args.environment), solver=solver)
+        layouts = args.layout if len(args.layout) > 1 else None
+        names = layout_creator.create_layouts(climatologies=args.climatologies, layouts=layouts)
+        start = time.monotonic()
+        results = layout_creator.run_layouts(names, max_workers=args.workers)
+        print(f'Ran {len(results)} layouts in {time.monotonic() - start:.1f}s, {sum(not r.ok for r in results)} failed')
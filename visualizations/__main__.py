@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+"""
+Command line interface of the headless part of the package, for conversion and queries without a display.
+
+    python -m visualizations convert --windfield "<project>/windfield" --cache "<project>/my_documentation" --heights 80 100 --workers 4
+    python -m visualizations info --cache "<project>/my_documentation" 000
+    python -m visualizations query --cache "<project>/my_documentation" --sector 000 --field speed --x 1000 --y 2000 --height 100
+    python -m visualizations wrg --cache "<project>/my_documentation" --sectors 000 030 ... --climatologies climatologies.json --heights 100 --cellsize 25
+    python -m visualizations archive --cache "<project>/my_documentation" --output archive --codec lzma
+    python -m visualizations serve --cache "<project>/my_documentation" --port 8765
+    python -m visualizations catalog --db catalog.sqlite --scan "<WindSim Projects 12>" --windspeed 20 --actuator-disk yes --solved
+    python -m visualizations compare "<old project>" "<new project>" --rtol 1e-4 --workers 4
+    python -m visualizations import-time
+
+None of the commands import pyvista or matplotlib, import-time checks that this stays so.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+# Modules that should load without the plotting libraries, and the libraries that must not be loaded by them
+CORE_MODULES = [
+    'visualizations.readers.phi_reader',
+    'visualizations.readers.xyz_reader',
+    'visualizations.readers.cache',
+    'visualizations.readers.catalog',
+    'visualizations.readers.shared',
+    'visualizations.analysis.compare',
+    'visualizations.analysis.geometry',
+    'visualizations.analysis.interpolation',
+    'visualizations.analysis.maps',
+    'visualizations.analysis.wrg',
+    'visualizations.pipeline',
+    'visualizations.server',
+]
+PLOTTING_MODULES = ['matplotlib', 'pyvista', 'vtk', 'vtkmodules', 'mpl_toolkits']
+
+
+def _cache(args: argparse.Namespace):
+    from .readers.cache import SectorCache
+    from .readers.grid_store import GridStore
+    return SectorCache(Path(args.cache), GridStore(Path(args.grids)) if args.grids else None)
+
+
+def convert(args: argparse.Namespace) -> int:
+    from .pipeline import process_sector
+
+    windfield = Path(args.windfield)
+    cache = _cache(args)
+    sectors = args.sectors or sorted(phi.stem for phi in windfield.glob('*.phi') if phi.with_suffix('.xyz').is_file())
+    if not args.force:
+        sectors = [sector for sector in sectors if not cache.is_fresh(sector, windfield)]
+    print(f'Converting {len(sectors)} sectors: {sectors}')
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {sector: pool.submit(process_sector, windfield, cache.folder, cache.grid_store.folder, sector, tuple(args.heights), args.read_workers) for sector in sectors}
+    failed = [sector for sector, future in futures.items() if future.exception() is not None]
+    for sector in failed:
+        print(f'Sector {sector} failed: {futures[sector].exception()}')
+    return 1 if failed else 0
+
+
+def info(args: argparse.Namespace) -> int:
+    cache = _cache(args)
+    sectors = args.sectors or cache.sectors()
+    if not sectors:
+        print(f'No converted sectors in {cache.folder}')
+        return 1
+    for sector in sectors:
+        dataset = cache.load(sector)
+        print(f'{sector}: grid {dataset.grid_hash or cache.grid_path(sector).name}, (z,x,y)={dataset.fields.shape}')
+        print(f'    stored:  {dataset.fields.stored}')
+        print(f'    derived: {dataset.fields.derived}')
+    return 0
+
+
+def query(args: argparse.Namespace) -> int:
+    import numpy as np
+    from .analysis.heights import bilinear, height_above_ground, horizontal_axes, interpolate_to_height
+
+    dataset = _cache(args).load(args.sector)
+    heights = height_above_ground(dataset.coord_centered, dataset.coord_ground)
+    x_centers, y_centers = horizontal_axes(dataset.coord_centered)
+    for field in args.field:
+        values = interpolate_to_height(np.moveaxis(dataset[field], 0, -1), heights, args.height)
+        value = bilinear(x_centers, y_centers, values, np.array([args.x]), np.array([args.y]), outer=False)[0]
+        print(f'{field.strip()} = {value:.6g}')
+    return 0
+
+
+def wrg(args: argparse.Namespace) -> int:
+    from .analysis.wrg import Climatology, WRGGenerator
+
+    folder = Path(args.cache)
+    generator = WRGGenerator.from_folder(folder, args.sectors)
+    generator.write(Path(args.output) if args.output else folder, Climatology.from_json(Path(args.climatologies)), args.heights, args.cellsize)
+    return 0
+
+
+def archive(args: argparse.Namespace) -> int:
+    import numpy as np
+    from .readers.archive import save_archive
+
+    cache = _cache(args)
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    grids = {}
+    for sector in args.sectors or cache.sectors():
+        print(f'Archiving sector {sector}')
+        with np.load(cache.phi_path(sector)) as phi:
+            save_archive(output / f'{sector}.phi.wsa', {'data': phi['data']}, attrs={'headers': phi['headers'].tolist()}, codec=args.codec, level=args.level, workers=args.workers)
+        # Sectors sharing a grid share its archive as well
+        grid_path = cache.grid_path(sector)
+        grid_name = f'{cache.grid_hash(sector)}.xyz.wsa' if cache.grid_hash(sector) else f'{sector}.xyz.wsa'
+        if grid_name not in grids:
+            with np.load(grid_path) as grid:
+                arrays = {key: grid[key] for key in grid.files if key != 'headers'}
+                save_archive(output / grid_name, arrays, attrs={'headers': grid['headers'].tolist()}, codec=args.codec, level=args.level, workers=args.workers)
+            grids[grid_name] = sector
+        (output / f'{sector}.grid').write_text(grid_name)
+    return 0
+
+
+def serve(args: argparse.Namespace) -> int:
+    import asyncio
+    from .server import SliceServer
+
+    server = SliceServer(_cache(args), max_bytes=int(args.cache_mb*1024**2))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print('Stopped')
+    return 0
+
+
+def catalog(args: argparse.Namespace) -> int:
+    from .readers.catalog import Catalog
+
+    with Catalog(Path(args.db)) as catalog:
+        if args.scan:
+            counts = catalog.scan(Path(args.scan))
+            print(f'Scanned {counts["projects"]} projects: {counts["parsed"]} project files, {counts["layouts"]} layouts and {counts["headers"]} phi headers read, {counts["errors"]} files could not be parsed, {counts["removed"]} removed')
+        actuator_disk = None if args.actuator_disk is None else args.actuator_disk == 'yes'
+        solved = True if args.solved else None
+        for entry in catalog.projects(windspeed=args.windspeed, actuator_disk=actuator_disk, solved=solved, name=args.name):
+            print(f'{entry["path"]}: windspeed {entry["windspeed"]}, actuator disk {bool(entry["actuator_disk"])}, {entry["n_solved"]}/{entry["n_sectors"]} sectors solved')
+    return 0
+
+
+def compare(args: argparse.Namespace) -> int:
+    from .analysis.compare import compare_files, compare_projects
+
+    a, b = Path(args.a), Path(args.b)
+    tolerances = dict(atol=args.atol, rtol=args.rtol, fields=args.fields, fail_fast=args.fail_fast)
+    if a.is_dir():
+        results = compare_projects(a, b, workers=args.workers, **tolerances)
+    else:
+        results = {a.name: compare_files(a, b, **tolerances)}
+    for result in results.values():
+        print(result.summary())
+    failed = [sector for sector, result in results.items() if not result.ok]
+    print(f'{len(results) - len(failed)} of {len(results)} sectors agree' + (f', different: {failed}' if failed else ''))
+    return 1 if failed else 0
+
+
+def import_time(args: argparse.Namespace) -> int:
+    """ Imports every core module in a fresh interpreter, and fails if one loads a plotting library or is slower than the budget """
+    script = (
+        'import json, sys, time\n'
+        't = time.perf_counter()\n'
+        f'import {{module}}\n'
+        'seconds = time.perf_counter() - t\n'
+        f'print(json.dumps({{{{"seconds": seconds, "plotting": [m for m in {PLOTTING_MODULES!r} if m in sys.modules]}}}}))\n'
+    )
+    failed = False
+    print(f'{"module":<40}{"seconds":>10}  plotting modules')
+    for module in args.modules or CORE_MODULES:
+        result = subprocess.run([sys.executable, '-c', script.format(module=module)], capture_output=True, text=True, cwd=Path(__file__).parent.parent)
+        if result.returncode != 0:
+            print(f'{module:<40}{"failed":>10}  {result.stderr.strip().splitlines()[-1]}')
+            failed = True
+            continue
+        timing = json.loads(result.stdout.strip().splitlines()[-1])
+        slow = timing['seconds'] > args.budget
+        failed = failed or slow or bool(timing['plotting'])
+        print(f'{module:<40}{timing["seconds"]:>10.3f}  {", ".join(timing["plotting"]) or "-"}{"  (over budget)" if slow else ""}')
+    return 1 if failed else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m visualizations', description="Conversion and queries of WindSim fields without a display.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    def cache_arguments(command: argparse.ArgumentParser) -> None:
+        command.add_argument('-c', '--cache', type=str, required=True, help='Folder of the converted sectors, i.e. <project>/my_documentation.')
+        command.add_argument('-g', '--grids', type=str, default=None, help='Grid store shared by several projects, default is <cache>/grids.')
+
+    command = commands.add_parser('convert', help='Convert the sectors of a windfield folder into the cache.')
+    command.add_argument('-w', '--windfield', type=str, required=True, help='The windfield folder of the project.')
+    cache_arguments(command)
+    command.add_argument('-s', '--sectors', type=str, nargs='+', default=None, help='Sectors to convert, default is all sectors with a .phi and a .xyz file.')
+    command.add_argument('--heights', type=float, nargs='*', default=[], help='Heights above ground of the hub height maps, default is no maps.')
+    command.add_argument('--workers', type=int, default=1, help='Number of sectors converted at the same time.')
+    command.add_argument('--read-workers', type=int, default=1, help='Processes decoding the fields of one phi file, for few very large sectors.')
+    command.add_argument('--force', action='store_true', help='Convert the sectors that are in the cache already as well.')
+    command.set_defaults(func=convert)
+
+    command = commands.add_parser('info', help='List the converted sectors with their fields.')
+    cache_arguments(command)
+    command.add_argument('sectors', type=str, nargs='*', help='Sectors to list, default is all.')
+    command.set_defaults(func=info)
+
+    command = commands.add_parser('query', help='Values of fields at a point and a height above ground.')
+    cache_arguments(command)
+    command.add_argument('-s', '--sector', type=str, required=True)
+    command.add_argument('-f', '--field', type=str, nargs='+', default=['speed'], help='Stored or derived fields, see readers/fields.py.')
+    command.add_argument('--x', type=float, required=True)
+    command.add_argument('--y', type=float, required=True)
+    command.add_argument('--height', type=float, required=True, help='Height above ground.')
+    command.set_defaults(func=query)
+
+    command = commands.add_parser('wrg', help='Write WRG files, see analysis/wrg.py.')
+    cache_arguments(command)
+    command.add_argument('-s', '--sectors', type=str, nargs='+', required=True, help='The sectors, in the same order as the sectors of the climatologies.')
+    command.add_argument('--climatologies', type=str, required=True, help='Json file with a list of climatologies.')
+    command.add_argument('--heights', type=float, nargs='+', required=True, help='Heights above ground to write.')
+    command.add_argument('--cellsize', type=float, required=True, help='Cell size of the resource grid.')
+    command.add_argument('-o', '--output', type=str, default=None, help='Output folder, default is the cache folder.')
+    command.set_defaults(func=wrg)
+
+    command = commands.add_parser('archive', help='Write archival copies of the converted sectors, see readers/archive.py.')
+    cache_arguments(command)
+    command.add_argument('-o', '--output', type=str, required=True, help='Folder of the archives.')
+    command.add_argument('-s', '--sectors', type=str, nargs='+', default=None, help='Sectors to archive, default is all.')
+    command.add_argument('--codec', type=str, default='zlib', choices=['zlib', 'lzma', 'none'])
+    command.add_argument('--level', type=int, default=6)
+    command.add_argument('--workers', type=int, default=None, help='Compression threads, default is the number of cores.')
+    command.set_defaults(func=archive)
+
+    command = commands.add_parser('serve', help='Serve slices of the converted sectors over http, see server.py.')
+    cache_arguments(command)
+    command.add_argument('--host', type=str, default='127.0.0.1', help='Only local clients by default.')
+    command.add_argument('--port', type=int, default=8765)
+    command.add_argument('--cache-mb', type=float, default=256, help='Size of the cached responses in MB.')
+    command.set_defaults(func=serve)
+
+    command = commands.add_parser('catalog', help='Scan and query the catalog of projects, see readers/catalog.py.')
+    command.add_argument('--db', type=str, required=True, help='The database file of the catalog, made if it does not exist.')
+    command.add_argument('--scan', type=str, default=None, help='Folder to scan for projects first, only changed files are read.')
+    command.add_argument('--windspeed', type=float, default=None, help='Only projects with this boundary layer windspeed.')
+    command.add_argument('--actuator-disk', type=str, default=None, choices=['yes', 'no'], help='Only projects with or without the actuator disk.')
+    command.add_argument('--solved', action='store_true', help='Only projects where every sector has a .phi file.')
+    command.add_argument('--name', type=str, default=None, help="Only projects with a name like this, i.e. '%%_AD_True_%%'.")
+    command.set_defaults(func=catalog)
+
+    command = commands.add_parser('compare', help='Compare the fields of two results within a tolerance, see analysis/compare.py.')
+    command.add_argument('a', type=str, help='A .phi, .phi.npz or .phi.wsa file, or a project, windfield, cache or archive folder.')
+    command.add_argument('b', type=str, help='The reference, of the same kind as a.')
+    command.add_argument('--atol', type=float, default=0.0, help='Absolute tolerance.')
+    command.add_argument('--rtol', type=float, default=1e-6, help='Relative tolerance, to |b|.')
+    command.add_argument('-f', '--fields', type=str, nargs='+', default=None, help="Stored fields to compare, i.e. UCRT 'KE', default is all.")
+    command.add_argument('--fail-fast', action='store_true', help='Stop a sector at the first slab outside the tolerance.')
+    command.add_argument('--workers', type=int, default=1, help='Number of sectors compared at the same time.')
+    command.set_defaults(func=compare)
+
+    command = commands.add_parser('import-time', help='Check that the core modules import fast and without the plotting libraries.')
+    command.add_argument('modules', type=str, nargs='*', help=f'Modules to import, default is {", ".join(CORE_MODULES)}.')
+    command.add_argument('--budget', type=float, default=1.0, help='Seconds allowed for the import of a module.')
+    command.set_defaults(func=import_time)
+
+    return parser
+
+
+def main(argv: Optional[List[str]]=None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
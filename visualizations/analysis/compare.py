@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/compare.py
+
+"""
+Tolerance based comparison of two sets of results, i.e. before and after a WindSim upgrade or a change of
+the solver settings, without loading the fields.
+
+The fields are streamed one (z) slab at a time from .phi files, converted sectors (<sector>.phi.npz in the
+cache) or archives (<sector>.phi.wsa), so the memory stays at a couple of slabs whatever the size of the
+sector. The headers are checked first: the dimensions, the stored fields and, between two phi files, the
+cell face locations Xloc/Yloc/Zloc, otherwise the grid hashes. Only when the dimensions and grids agree
+the fields stored in both are compared, with per field the largest absolute and relative difference, the RMS difference and the number
+of values outside atol + rtol*|b|, like numpy.isclose with b as the reference.
+
+    result = compare_files(Path('old/windfield/000.phi'), Path('new/windfield/000.phi'), rtol=1e-4)
+    results = compare_projects(Path('old'), Path('new'), rtol=1e-4, workers=4)
+"""
+import mmap
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..readers.archive import Archive
+from ..readers.phi_reader import Phi, decode_slab, slab_layout
+
+# Header values of a phi file that must agree, the others are reported as notes
+STRUCTURAL_VARS = ('CARTES', 'BFC', 'NX', 'NY', 'NZ')
+
+
+class PhiSlabs:
+    # a phi file is written z by z, the fields of a slab one after the other
+    order = 'z'
+
+    def __init__(self, path: Path):
+        """ The slabs of a .phi file, decoded when they are asked for """
+        self.path = path
+        self.header = Phi()
+        with open(path, 'r') as phiFile:
+            offset = self.header.readHeader(phiFile, verbose=False)
+        self.names = [name.strip() for name in self.header.FieldNames]
+        self.shape = (self.header.nz, self.header.nx, self.header.ny)
+        self.faces = (np.asarray(self.header.Xloc), np.asarray(self.header.Yloc), np.asarray(self.header.Zloc))
+        self.grid_id: Optional[str] = None
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        n = self.header.nx*self.header.ny
+        n_slabs = self.header.nz*len(self.names)
+        slab_bytes = slab_layout(self._mm, offset, n, n_slabs)
+        if slab_bytes is not None:
+            self._starts = [offset + i*slab_bytes for i in range(n_slabs + 1)]
+        else:
+            # slabs of different sizes, i.e. a file edited by hand, the line ends give where they start
+            self._starts = [offset]
+            for _ in range(n_slabs):
+                end = self._starts[-1]
+                for _ in range((n + 5)//6):
+                    end = self._mm.find(b'\n', end) + 1
+                self._starts.append(end)
+
+    def slab(self, field: int, iz: int) -> NDArray[np.float64]:
+        index = iz*len(self.names) + field
+        nz, nx, ny = self.shape
+        return decode_slab(self._mm[self._starts[index]:self._starts[index+1]], nx*ny).reshape(nx, ny)
+
+    def slabs(self, order: str) -> Iterator[Tuple[int, int, NDArray[np.float64]]]:
+        for field, iz in _slab_order(len(self.names), self.shape[0], order):
+            yield field, iz, self.slab(field, iz)
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+
+class NpzSlabs:
+    # the fields of a converted sector are stored (field,z,x,y) and compressed, they can only be read in that order
+    order = 'field'
+
+    def __init__(self, path: Path):
+        """ The slabs of a converted sector, <sector>.phi.npz, streamed from the compressed file """
+        self.path = path
+        self._zip = zipfile.ZipFile(path)
+        with np.load(path) as npz:
+            self.names = [str(name).strip() for name in npz['headers']]
+        self._data = self._zip.open('data.npy')
+        version = np.lib.format.read_magic(self._data)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, self.dtype = read_header(self._data)
+        if fortran_order:
+            raise ValueError(f'{path} is not in C order and can not be streamed.')
+        self.shape = tuple(shape[1:])
+        self.faces = None
+        # the reference to the grid store written next to the fields, see readers/cache.py
+        reference = path.with_name(path.name[:-len('.phi.npz')] + '.grid')
+        self.grid_id = reference.read_text().strip() if reference.is_file() else None
+
+    def slabs(self, order: str) -> Iterator[Tuple[int, int, NDArray[np.float64]]]:
+        if order != self.order:
+            raise ValueError('The fields of a converted sector can only be read field by field.')
+        nz, nx, ny = self.shape
+        for field, iz in _slab_order(len(self.names), nz, order):
+            slab = np.frombuffer(self._data.read(nx*ny*self.dtype.itemsize), dtype=self.dtype)
+            yield field, iz, slab.reshape(nx, ny)
+
+    def close(self) -> None:
+        self._data.close()
+        self._zip.close()
+
+
+class ArchiveSlabs:
+    order = 'field'
+
+    def __init__(self, path: Path):
+        """ The slabs of an archived sector, <sector>.phi.wsa, see readers/archive.py, one chunk is decompressed at a time """
+        self.path = path
+        self._archive = Archive(path, workers=1)
+        self.names = [name.strip() for name in self._archive.attrs['headers']]
+        self.shape = tuple(self._archive.shape('data')[1:])
+        self.faces = None
+        # written by python -m visualizations archive, the name of the grid archive, <hash>.xyz.wsa
+        reference = path.with_name(path.name[:-len('.phi.wsa')] + '.grid')
+        self.grid_id = reference.read_text().strip()[:-len('.xyz.wsa')] if reference.is_file() else None
+        self._chunk: Tuple[int, Optional[NDArray]] = (-1, None)
+
+    def slab(self, field: int, iz: int) -> NDArray[np.float64]:
+        nz, nx, ny = self.shape
+        row = field*nz + iz
+        chunk, offset = divmod(row, self._archive.chunk_rows('data'))
+        if self._chunk[0] != chunk:
+            self._chunk = (chunk, self._archive.read_chunk('data', chunk))
+        return self._chunk[1][offset].reshape(nx, ny)
+
+    def slabs(self, order: str) -> Iterator[Tuple[int, int, NDArray[np.float64]]]:
+        for field, iz in _slab_order(len(self.names), self.shape[0], order):
+            yield field, iz, self.slab(field, iz)
+
+    def close(self) -> None:
+        self._archive.close()
+
+
+def _slab_order(n_fields: int, nz: int, order: str) -> Iterator[Tuple[int, int]]:
+    if order == 'z':
+        return ((field, iz) for iz in range(nz) for field in range(n_fields))
+    return ((field, iz) for field in range(n_fields) for iz in range(nz))
+
+
+def open_slabs(path: Path):
+    """ The slab reader for a .phi file, a converted sector (.phi.npz) or an archived sector (.phi.wsa) """
+    if path.name.endswith('.npz'):
+        return NpzSlabs(path)
+    if path.name.endswith('.wsa'):
+        return ArchiveSlabs(path)
+    return PhiSlabs(path)
+
+
+class FieldDifference:
+    def __init__(self, name: str, n_slabs: int=0):
+        """ n_slabs: the (z) slabs of the field, it is compared when all of them are """
+        self.name = name
+        self.n_slabs = n_slabs
+        self.slabs = 0
+        self.max_abs = 0.0
+        self.max_rel = 0.0
+        self.location: Optional[Tuple[int, int, int]] = None
+        self.violations = 0
+        self._squares = 0.0
+        self._count = 0
+
+    def update(self, iz: int, a: NDArray[np.float64], b: NDArray[np.float64], atol: float, rtol: float) -> int:
+        """ Adds the slab iz of both fields, returns the number of values outside the tolerance """
+        difference = np.abs(a - b)
+        # NaN in one of the fields counts as an infinite difference
+        difference[np.isnan(difference)] = np.inf
+        reference = np.abs(b)
+        violations = int(np.count_nonzero(difference > atol + rtol*reference))
+        index = np.unravel_index(np.argmax(difference), difference.shape)
+        if difference[index] > self.max_abs or self.location is None:
+            self.max_abs = float(difference[index])
+            self.location = (iz, int(index[0]), int(index[1]))
+        nonzero = reference > 0
+        if nonzero.any():
+            self.max_rel = max(self.max_rel, float((difference[nonzero] / reference[nonzero]).max()))
+        self.violations += violations
+        self._squares += float(np.square(difference).sum())
+        self._count += difference.size
+        self.slabs += 1
+        return violations
+
+    @property
+    def rms(self) -> float:
+        return float(np.sqrt(self._squares / self._count)) if self._count else 0.0
+
+    @property
+    def compared(self) -> bool:
+        return self.slabs >= self.n_slabs
+
+    @property
+    def ok(self) -> Optional[bool]:
+        """ False with values outside the tolerance, None when the comparison stopped before all slabs of the field were compared """
+        if self.violations:
+            return False
+        return True if self.compared else None
+
+    def __repr__(self) -> str:
+        if not self.slabs:
+            return f'FieldDifference({self.name!r}, not compared)'
+        partial = '' if self.compared else f', compared {self.slabs} of {self.n_slabs} slabs'
+        return (f'FieldDifference({self.name!r}, max_abs={self.max_abs:.3g} at (z,x,y)={self.location}, max_rel={self.max_rel:.3g}, '
+                f'rms={self.rms:.3g}, violations={self.violations}{partial})')
+
+
+class Comparison:
+    def __init__(self, a: Path, b: Path):
+        self.a = a
+        self.b = b
+        self.problems: List[str] = []
+        self.notes: List[str] = []
+        self.fields: Dict[str, FieldDifference] = {}
+        self.stopped_early = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems and all(difference.ok for difference in self.fields.values())
+
+    def summary(self) -> str:
+        lines = [f'{self.a} vs {self.b}: {"ok" if self.ok else "DIFFERENT"}']
+        lines.extend(f'    problem: {problem}' for problem in self.problems)
+        lines.extend(f'    note: {note}' for note in self.notes)
+        lines.extend(f'    {difference}' for difference in self.fields.values())
+        if self.stopped_early:
+            lines.append('    stopped at the first slab outside the tolerance')
+        return '\n'.join(lines)
+
+
+def compare_headers(a, b, result: Comparison, face_atol: float=1e-3) -> bool:
+    """
+    Dimensions, stored fields and grids of the two slab readers, False if the fields can not be compared.
+    Different stored fields are recorded as a problem, the fields stored in both are still compared.
+    """
+    if a.shape != b.shape:
+        result.problems.append(f'(z,x,y) differ: {a.shape} and {b.shape}')
+        return False
+    only_a, only_b = sorted(set(a.names) - set(b.names)), sorted(set(b.names) - set(a.names))
+    if only_a or only_b:
+        result.problems.append(f'Stored fields differ, only in a: {only_a}, only in b: {only_b}')
+    comparable = True
+    if isinstance(a, PhiSlabs) and isinstance(b, PhiSlabs):
+        for key in STRUCTURAL_VARS:
+            if a.header.Vars[key] != b.header.Vars[key]:
+                result.problems.append(f'{key} differs: {a.header.Vars[key]} and {b.header.Vars[key]}')
+                comparable = False
+        result.notes.extend(f'{key} differs: {value} and {b.header.Vars.get(key)}'
+                            for key, value in a.header.Vars.items() if key not in STRUCTURAL_VARS and b.header.Vars.get(key) != value)
+    if a.faces is not None and b.faces is not None:
+        for axis, face_a, face_b in zip('XYZ', a.faces, b.faces):
+            if face_a.shape != face_b.shape or not np.allclose(face_a, face_b, rtol=0, atol=face_atol):
+                result.problems.append(f'{axis}loc differs, the grids are not the same')
+                return False
+    elif a.grid_id is not None and b.grid_id is not None:
+        if a.grid_id != b.grid_id:
+            result.problems.append(f'The grids differ: {a.grid_id} and {b.grid_id}')
+            return False
+    else:
+        result.notes.append('The grids are not compared, the cell face locations or grid hashes are missing on one side')
+    return comparable
+
+
+# the reader that is streamed in its own order, the other one is read at the slabs asked for
+STREAMING = {NpzSlabs: 2, ArchiveSlabs: 1, PhiSlabs: 0}
+
+
+def _slab_pairs(a, b, result: Comparison) -> Iterator[Tuple[str, Tuple[int, int, NDArray[np.float64], NDArray[np.float64]]]]:
+    """ The slabs of both readers by field name, two phi files are read front to back, otherwise in the order of the npz or archive """
+    if isinstance(a, NpzSlabs) and isinstance(b, NpzSlabs):
+        # both are streamed, the slabs of the fields only one of them stores are skipped
+        if [name for name in a.names if name in b.names] != [name for name in b.names if name in a.names]:
+            result.problems.append('The fields of the converted sectors are stored in a different order and can not be streamed together')
+            return
+        slabs_b = b.slabs(b.order)
+        for field, iz, slab_a in a.slabs(a.order):
+            name = a.names[field]
+            if name not in b.names:
+                continue
+            for field_b, _, slab_b in slabs_b:
+                if b.names[field_b] == name:
+                    break
+            yield name, (field, iz, slab_a, slab_b)
+        return
+    streamed, other = (b, a) if STREAMING[type(b)] > STREAMING[type(a)] else (a, b)
+    for field, iz, slab in streamed.slabs(streamed.order):
+        name = streamed.names[field]
+        if name not in other.names:
+            continue
+        slab_other = other.slab(other.names.index(name), iz)
+        yield name, ((field, iz, slab, slab_other) if streamed is a else (field, iz, slab_other, slab))
+
+
+def compare_files(a: Path, b: Path, atol: float=0.0, rtol: float=1e-6, fields: Optional[Sequence[str]]=None, fail_fast: bool=False, face_atol: float=1e-3) -> Comparison:
+    """
+    Compares the fields of a with the reference b, slab by slab.
+    a, b: .phi files, converted sectors (.phi.npz) or archived sectors (.phi.wsa), in any combination
+    atol, rtol: values differ when |a - b| > atol + rtol*|b|
+    fields: the stored fields to compare, default is all fields stored in both
+    fail_fast: stop at the first slab with values outside the tolerance, the fields not compared to the end have ok None
+    face_atol: tolerance of the cell face locations, in m
+    """
+    result = Comparison(a, b)
+    reader_a, reader_b = open_slabs(a), open_slabs(b)
+    try:
+        if not compare_headers(reader_a, reader_b, result, face_atol):
+            return result
+        wanted = [name.strip() for name in fields] if fields else reader_a.names
+        names = [name for name in wanted if name in reader_a.names and name in reader_b.names]
+        missing = [name for name in wanted if name not in names]
+        if missing:
+            result.problems.append(f'Fields not stored in both: {missing}')
+        for name in names:
+            result.fields[name] = FieldDifference(name, n_slabs=reader_a.shape[0])
+
+        for name, (field, iz, slab_a, slab_b) in _slab_pairs(reader_a, reader_b, result):
+            if name not in result.fields:
+                continue
+            if result.fields[name].update(iz, slab_a, slab_b, atol, rtol) and fail_fast:
+                result.stopped_early = True
+                break
+    finally:
+        reader_a.close()
+        reader_b.close()
+    return result
+
+
+def sector_files(folder: Path) -> Dict[str, Path]:
+    """ The results of the sectors in a project, its windfield folder, a cache of converted sectors or a folder of archives """
+    if (folder / 'windfield').is_dir():
+        folder = folder / 'windfield'
+    for pattern, suffix in (('*.phi', '.phi'), ('*.phi.npz', '.phi.npz'), ('*.phi.wsa', '.phi.wsa')):
+        files = {path.name[:-len(suffix)]: path for path in sorted(folder.glob(pattern))}
+        if files:
+            return files
+    return {}
+
+
+def compare_projects(a: Path, b: Path, workers: int=1, **tolerances) -> Dict[str, Comparison]:
+    """ compare_files for every sector of two projects, the sectors in workers processes. Sectors of only one project are reported as problems """
+    files_a, files_b = sector_files(a), sector_files(b)
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {sector: pool.submit(compare_files, path, files_b[sector], **tolerances) for sector, path in files_a.items() if sector in files_b}
+        for sector, future in futures.items():
+            results[sector] = future.result()
+    for sector in sorted(set(files_a) ^ set(files_b)):
+        result = Comparison(files_a.get(sector, a), files_b.get(sector, b))
+        result.problems.append(f'Sector {sector} is only in {"a" if sector in files_a else "b"}')
+        results[sector] = result
+    return dict(sorted(results.items()))
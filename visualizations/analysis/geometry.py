@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/geometry.py
+
+"""
+Geometry of the hexahedral cells of the curvilinear grid, from the node coordinates (coord_vertices),
+and reductions of the fields over regions and through planes.
+
+Face area vectors are half the cross product of the face diagonals, pointing towards increasing
+index. Volumes follow from the divergence theorem, V = 1/3 sum(S_f . c_f) over the six faces with
+the face centres c_f, which is exact for the trilinear cells. The metric terms are the jacobian of the
+mapping from index space to x,y,z at the cell centres, and its inverse.
+
+The arrays have the layout of the saved grid: cells (x,y,z), the faces normal to axis a have one entry
+more along a. The geometry of a grid is computed once and cached next to it, see load_geometry.
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..readers.cache import SectorCache
+
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+
+def _face_vectors(vertices: NDArray[np.float64], axis: int) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """ Area vectors and centres of the faces normal to the index axis, (...,3) """
+    # the two other axes in cyclic order, so the cross product of the diagonals points along +axis
+    a1, a2 = (axis + 1) % 3, (axis + 2) % 3
+
+    def corner(o1: int, o2: int) -> NDArray[np.float64]:
+        index = [slice(None)] * 3
+        index[a1] = slice(o1, vertices.shape[a1] - 1 + o1)
+        index[a2] = slice(o2, vertices.shape[a2] - 1 + o2)
+        return vertices[tuple(index)]
+
+    p00, p10, p11, p01 = corner(0, 0), corner(1, 0), corner(1, 1), corner(0, 1)
+    area = 0.5*np.cross(p11 - p00, p01 - p10)
+    centre = 0.25*(p00 + p10 + p11 + p01)
+    return area, centre
+
+
+def _cells(array: NDArray[np.float64], axis: int, upper: bool) -> NDArray[np.float64]:
+    """ The faces on the lower or upper side of the cells along the axis """
+    index = [slice(None)] * array.ndim
+    index[axis] = slice(1, None) if upper else slice(None, -1)
+    return array[tuple(index)]
+
+
+class CellGeometry:
+    def __init__(self, volume: NDArray[np.float64], faces: Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]], jacobian: NDArray[np.float64]):
+        """
+        volume: cell volumes (x,y,z)
+        faces: area vectors of the faces normal to the x, y and z index axes, (x+1,y,z,3), (x,y+1,z,3), (x,y,z+1,3)
+        jacobian: d(x,y,z)/d(i,j,k) at the cell centres, (x,y,z,3,3)
+        """
+        self.volume = volume
+        self.faces = faces
+        self.jacobian = jacobian
+
+    @classmethod
+    def from_vertices(cls, vertices: NDArray[np.float64]) -> 'CellGeometry':
+        """ From the node coordinates (x,y,z,3), as in coord_vertices """
+        vertices = np.asarray(vertices, dtype=np.float64)
+        faces, volume = [], 0
+        for axis in range(3):
+            area, centre = _face_vectors(vertices, axis)
+            flux = np.einsum('...i,...i->...', area, centre)
+            volume = volume + (_cells(flux, axis, True) - _cells(flux, axis, False))/3
+            faces.append(area)
+
+        # edge vectors along i, j and k averaged over the four parallel edges of every cell
+        columns = []
+        for axis in range(3):
+            edges = _cells(vertices, axis, True) - _cells(vertices, axis, False)
+            a1, a2 = (axis + 1) % 3, (axis + 2) % 3
+            edges = 0.5*(_cells(edges, a1, True) + _cells(edges, a1, False))
+            columns.append(0.5*(_cells(edges, a2, True) + _cells(edges, a2, False)))
+        jacobian = np.stack(columns, axis=-1)
+        return cls(volume, tuple(faces), jacobian)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.volume.shape
+
+    def areas(self, axis: int) -> NDArray[np.float64]:
+        return np.linalg.norm(self.faces[axis], axis=-1)
+
+    def normals(self, axis: int) -> NDArray[np.float64]:
+        """ Unit normals of the faces normal to the index axis, towards increasing index """
+        return self.faces[axis] / self.areas(axis)[...,None]
+
+    @property
+    def determinant(self) -> NDArray[np.float64]:
+        return np.linalg.det(self.jacobian)
+
+    @property
+    def inverse_jacobian(self) -> NDArray[np.float64]:
+        """ d(i,j,k)/d(x,y,z), the rows are the gradients of the index coordinates """
+        return np.linalg.inv(self.jacobian)
+
+    def save(self, path: Path) -> None:
+        np.savez(path, volume=self.volume, face_x=self.faces[0], face_y=self.faces[1], face_z=self.faces[2], jacobian=self.jacobian)
+
+    @classmethod
+    def load(cls, path: Path) -> 'CellGeometry':
+        with np.load(path) as geometry:
+            return cls(geometry['volume'], (geometry['face_x'], geometry['face_y'], geometry['face_z']), geometry['jacobian'])
+
+
+_loaded: Dict[Path, CellGeometry] = {}
+_lock = threading.Lock()
+
+
+def load_geometry(cache: SectorCache, sector: str) -> CellGeometry:
+    """ The geometry of the grid of the sector, computed once per grid and kept next to it, see SectorCache.geometry_path """
+    path = cache.geometry_path(sector)
+    with _lock:
+        if path not in _loaded:
+            if path.is_file():
+                _loaded[path] = CellGeometry.load(path)
+            else:
+                with np.load(cache.grid_path(sector)) as grid:
+                    geometry = CellGeometry.from_vertices(grid['coord_vertices'])
+                # Written under a temporary name first, several processes may compute the same grid at the same time
+                temporary = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp.npz')
+                geometry.save(temporary)
+                os.replace(temporary, path)
+                _loaded[path] = geometry
+        return _loaded[path]
+
+
+def integrate(field: NDArray[np.float64], volume: NDArray[np.float64], mask: Optional[NDArray[np.bool_]]=None) -> float:
+    """ Volume integral of the cell field (x,y,z) over the cells in mask, or the whole domain """
+    if mask is None:
+        return float(np.einsum('ijk,ijk->', field, volume))
+    return float(np.dot(field[mask], volume[mask]))
+
+
+def volume_mean(field: NDArray[np.float64], volume: NDArray[np.float64], mask: Optional[NDArray[np.bool_]]=None) -> float:
+    """ Volume weighted mean of the cell field (x,y,z) over the cells in mask, or the whole domain """
+    total = volume.sum() if mask is None else volume[mask].sum()
+    return integrate(field, volume, mask) / float(total)
+
+
+def region_mask(coord_centered: NDArray[np.float64], coord_ground: Optional[NDArray[np.float64]]=None, x: Tuple[float, float]=(-np.inf, np.inf), y: Tuple[float, float]=(-np.inf, np.inf), height: Tuple[float, float]=(-np.inf, np.inf)) -> NDArray[np.bool_]:
+    """ The cells with centres within the x, y limits and, with coord_ground given, the limits of the height above ground, otherwise of z """
+    X, Y, Z = coord_centered[...,0], coord_centered[...,1], coord_centered[...,2]
+    if coord_ground is not None:
+        Z = Z - coord_ground[:,:,None]
+    return (x[0] <= X) & (X <= x[1]) & (y[0] <= Y) & (Y <= y[1]) & (height[0] <= Z) & (Z <= height[1])
+
+
+def face_values(field: NDArray[np.float64], axis: int, index: int) -> NDArray[np.float64]:
+    """ The cell field (x,y,z,...) on the faces of the node plane index along axis, the mean of the two neighbouring cells, or the boundary cell """
+    n = field.shape[axis]
+    lower = np.take(field, max(index - 1, 0), axis=axis)
+    upper = np.take(field, min(index, n - 1), axis=axis)
+    return 0.5*(lower + upper)
+
+
+def flux_through_plane(geometry: CellGeometry, velocity: NDArray[np.float64], axis: int, index: int, density: float=1.0, mask: Optional[NDArray[np.bool_]]=None) -> float:
+    """
+    Flux density * u . S through the node plane index normal to the index axis, towards increasing index.
+    velocity: (x,y,z,3) at the cell centres, i.e. np.stack of UCRT, VCRT, WCRT moved to (x,y,z)
+    mask: the faces of the plane to include, the shape of the plane
+    """
+    faces = np.take(geometry.faces[axis], index, axis=axis)
+    flux = np.einsum('...i,...i->...', face_values(velocity, axis, index), faces)
+    return density*float(flux.sum() if mask is None else flux[mask].sum())
+
+
+def boundary_fluxes(geometry: CellGeometry, velocity: NDArray[np.float64], density: float=1.0) -> Dict[str, float]:
+    """ Outward flux through the six boundaries of the domain, the sum is the mass imbalance of the solution """
+    fluxes = {}
+    for name, axis in AXES.items():
+        n = geometry.faces[axis].shape[axis]
+        fluxes[f'{name}_min'] = -flux_through_plane(geometry, velocity, axis, 0, density)
+        fluxes[f'{name}_max'] = flux_through_plane(geometry, velocity, axis, n - 1, density)
+    return fluxes
+
+
+def velocity(fields) -> NDArray[np.float64]:
+    """ The velocity (x,y,z,3) at the cell centres from the field registry of a sector """
+    return np.stack([np.moveaxis(fields[name], 0, -1) for name in ('UCRT', 'VCRT', 'WCRT')], axis=-1)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/heights.py
+
+"""
+Vectorized interpolation of the cell centered fields to heights above ground and to regular
+horizontal grids.
+
+The arrays have the layout of the saved grid, (x,y,z). A field from a phi file, with the layout
+(z,x,y), is turned around with np.moveaxis(field, 0, -1).
+The horizontal interpolation assumes that the x coordinate only varies with the x index and the y
+coordinate only with the y index, which is the case for the terrain following WindSim grids.
+"""
+from typing import Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+
+def height_above_ground(coord_centered: NDArray[np.float64], coord_ground: NDArray[np.float64]) -> NDArray[np.float64]:
+    """ Height above ground of the cell centers, (x,y,z) """
+    return coord_centered[:,:,:,2] - coord_ground[:,:,None]
+
+
+def vertical_weights(heights: NDArray[np.float64], height: float) -> Tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """
+    The index of the cell below the height and the weight of the cell above it, for every column.
+    Heights below the first cell center take the first cell, above the last cell center the last cell.
+    """
+    nz = heights.shape[-1]
+    above = np.clip((heights < height).sum(axis=-1), 1, nz-1)
+    below = above - 1
+    h0 = np.take_along_axis(heights, below[...,None], axis=-1)[...,0]
+    h1 = np.take_along_axis(heights, above[...,None], axis=-1)[...,0]
+    weight = np.clip((height - h0) / (h1 - h0), 0, 1)
+    return below, weight
+
+
+def interpolate_to_height(field: NDArray[np.float64], heights: NDArray[np.float64], height: float) -> NDArray[np.float64]:
+    """ Linear interpolation in every column of field (x,y,z) to the height above ground, gives (x,y) """
+    below, weight = vertical_weights(heights, height)
+    f0 = np.take_along_axis(field, below[...,None], axis=-1)[...,0]
+    f1 = np.take_along_axis(field, below[...,None]+1, axis=-1)[...,0]
+    return f0 + weight*(f1 - f0)
+
+
+def axis_weights(centers: NDArray[np.float64], points: NDArray[np.float64]) -> Tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """ Lower index and weight of the upper neighbour of points along one axis, clamped at the edges """
+    upper = np.clip(np.searchsorted(centers, points), 1, len(centers)-1)
+    lower = upper - 1
+    weight = np.clip((points - centers[lower]) / (centers[upper] - centers[lower]), 0, 1)
+    return lower, weight
+
+
+def bilinear(x_centers: NDArray[np.float64], y_centers: NDArray[np.float64], values: NDArray[np.float64], x: NDArray[np.float64], y: NDArray[np.float64], outer: bool=True) -> NDArray[np.float64]:
+    """
+    Bilinear interpolation of values (x,y,...) given at x_centers, y_centers.
+    With outer=True x and y span a regular grid and the result is (len(x),len(y),...),
+    otherwise x and y are points of the same shape.
+    """
+    i, wx = axis_weights(x_centers, np.asarray(x, dtype=float))
+    j, wy = axis_weights(y_centers, np.asarray(y, dtype=float))
+    if outer:
+        i, wx = i[:,None], wx[:,None]
+        j, wy = j[None,:], wy[None,:]
+    #trailing axes of values, i.e. several heights or sectors at once
+    extra = (None,) * (values.ndim - 2)
+    wx, wy = wx[(...,) + extra], wy[(...,) + extra]
+    return ((1-wx)*(1-wy)*values[i,j] + wx*(1-wy)*values[i+1,j]
+            + (1-wx)*wy*values[i,j+1] + wx*wy*values[i+1,j+1])
+
+
+def horizontal_axes(coord_centered: NDArray[np.float64]) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """ The x and y coordinates of the cell center columns """
+    return coord_centered[:,0,0,0], coord_centered[0,:,0,1]
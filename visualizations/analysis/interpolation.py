@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/interpolation.py
+
+"""
+Interpolation operators for sections that do not follow the grid lines: vertical sections along a
+polyline (Transect), tilted planes (TiltedPlane) and surfaces at a height above ground (TerrainSurface).
+
+A section is compiled once against a grid into an InterpolationOperator: for every output point the
+flat indices of the 8 surrounding cell centres in a (z,x,y) field and their weights, bilinear between
+the four columns and linear in each column. That is a sparse matrix with 8 entries per row, stored as
+two (points,8) arrays, and applying it to a field is a single gather and sum, without searching the
+grid again. The operator only depends on the grid, so it is stored next to the grid in the grid store,
+named by the grid hash and the hash of the section, and shared by all sectors and variants on that grid:
+    op = load_operator(cache, '000', Transect([(0, 0), (2000, 500), (4000, 500)], spacing=25, heights=range(10, 300, 10)))
+    speed = op(dataset['speed'])          # (along, height)
+Points outside of the grid horizontally are NaN, and points of tilted planes below the first or above the
+last cell centre. Heights above ground outside of the cell centres take the first or last cell.
+"""
+import hashlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..readers.cache import SectorCache
+from .heights import axis_weights, height_above_ground, horizontal_axes
+
+
+class Section(ABC):
+    kind = ''
+
+    @abstractmethod
+    def params(self) -> Dict[str, Any]:
+        """ The definition of the section, json serializable """
+
+    @property
+    def key(self) -> str:
+        """ Hash of the definition, part of the name of the cached operator """
+        text = json.dumps({'kind': self.kind, **self.params()}, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+    @abstractmethod
+    def points(self, coord_centered: NDArray[np.float64], coord_ground: NDArray[np.float64]) -> Tuple[NDArray[np.float64], bool, Tuple[int, ...]]:
+        """ The output points (n,3), whether their z is the height above ground, and the shape of the output """
+
+
+class Transect(Section):
+    kind = 'transect'
+
+    def __init__(self, vertices: Sequence[Tuple[float, float]], spacing: float, heights: Iterable[float]):
+        """ Vertical section along the polyline through vertices, points every spacing along the line at the heights above ground """
+        self.vertices = np.asarray(vertices, dtype=float)
+        self.spacing = float(spacing)
+        self.heights = np.asarray(list(heights), dtype=float)
+        if len(self.vertices) < 2:
+            raise ValueError('A transect needs at least two vertices.')
+
+    def params(self) -> Dict[str, Any]:
+        return {'vertices': self.vertices.tolist(), 'spacing': self.spacing, 'heights': self.heights.tolist()}
+
+    def distance(self) -> NDArray[np.float64]:
+        """ Distance along the polyline of the points """
+        length = np.linalg.norm(np.diff(self.vertices, axis=0), axis=1).sum()
+        return np.append(np.arange(0, length, self.spacing), length)
+
+    def points(self, coord_centered, coord_ground):
+        cumulative = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(self.vertices, axis=0), axis=1))])
+        distance = self.distance()
+        x = np.interp(distance, cumulative, self.vertices[:,0])
+        y = np.interp(distance, cumulative, self.vertices[:,1])
+        X, H = np.meshgrid(x, self.heights, indexing='ij')
+        Y, _ = np.meshgrid(y, self.heights, indexing='ij')
+        return np.stack([X, Y, H], axis=-1).reshape(-1, 3), True, X.shape
+
+
+class TiltedPlane(Section):
+    kind = 'plane'
+
+    def __init__(self, origin: Sequence[float], u: Sequence[float], v: Sequence[float], size: Tuple[float, float], spacing: float):
+        """ Plane through origin (x,y,z above sea) spanned by the directions u and v, size (along u, along v) sampled every spacing """
+        self.origin = np.asarray(origin, dtype=float)
+        self.u = np.asarray(u, dtype=float) / np.linalg.norm(u)
+        self.v = np.asarray(v, dtype=float) / np.linalg.norm(v)
+        self.size = (float(size[0]), float(size[1]))
+        self.spacing = float(spacing)
+
+    def params(self) -> Dict[str, Any]:
+        return {'origin': self.origin.tolist(), 'u': self.u.tolist(), 'v': self.v.tolist(), 'size': list(self.size), 'spacing': self.spacing}
+
+    def points(self, coord_centered, coord_ground):
+        a = np.arange(0, self.size[0] + 0.5*self.spacing, self.spacing)
+        b = np.arange(0, self.size[1] + 0.5*self.spacing, self.spacing)
+        points = self.origin + a[:,None,None]*self.u + b[None,:,None]*self.v
+        return points.reshape(-1, 3), False, (len(a), len(b))
+
+
+class TerrainSurface(Section):
+    kind = 'terrain'
+
+    def __init__(self, height: float, cellsize: float, bounds: Optional[Tuple[float, float, float, float]]=None):
+        """ Regular grid with cellsize at the height above ground, within bounds (xmin, xmax, ymin, ymax) or the cell centres """
+        self.height = float(height)
+        self.cellsize = float(cellsize)
+        self.bounds = None if bounds is None else tuple(float(b) for b in bounds)
+
+    def params(self) -> Dict[str, Any]:
+        return {'height': self.height, 'cellsize': self.cellsize, 'bounds': self.bounds}
+
+    def points(self, coord_centered, coord_ground):
+        x_centers, y_centers = horizontal_axes(coord_centered)
+        xmin, xmax, ymin, ymax = self.bounds or (x_centers[0], x_centers[-1], y_centers[0], y_centers[-1])
+        x = xmin + self.cellsize*np.arange(int(np.floor((xmax - xmin)/self.cellsize)) + 1)
+        y = ymin + self.cellsize*np.arange(int(np.floor((ymax - ymin)/self.cellsize)) + 1)
+        X, Y = np.meshgrid(x, y, indexing='ij')
+        return np.stack([X, Y, np.full(X.shape, self.height)], axis=-1).reshape(-1, 3), True, X.shape
+
+
+class InterpolationOperator:
+    def __init__(self, indices: NDArray[np.int64], weights: NDArray[np.float64], shape: Tuple[int, ...], valid: NDArray[np.bool_], points: NDArray[np.float64]):
+        """
+        indices, weights: (points,8), flat indices into a (z,x,y) field and their weights
+        shape: the shape of the output, the points are in C order
+        valid: the points inside the grid
+        points: x, y, z above sea of the points, (points,3)
+        """
+        self.indices = indices
+        self.weights = weights
+        self.shape = tuple(shape)
+        self.valid = valid
+        self.points = points
+
+    def __call__(self, field: NDArray[np.float64]) -> NDArray[np.float64]:
+        """ The field (z,x,y), or stacked fields (...,z,x,y), at the points, with shape (...,) + shape """
+        flat = field.reshape(field.shape[:-3] + (-1,))
+        values = np.einsum('...pk,pk->...p', flat[..., self.indices], self.weights)
+        values[..., ~self.valid] = np.nan
+        return values.reshape(field.shape[:-3] + self.shape)
+
+    def save(self, path: Path) -> None:
+        np.savez(path, indices=self.indices, weights=self.weights, shape=np.array(self.shape), valid=self.valid, points=self.points)
+
+    @classmethod
+    def load(cls, path: Path) -> 'InterpolationOperator':
+        with np.load(path) as operator:
+            return cls(operator['indices'], operator['weights'], tuple(operator['shape']), operator['valid'], operator['points'])
+
+
+def _column_weights(levels: NDArray[np.float64], z: NDArray[np.float64]) -> Tuple[NDArray[np.int64], NDArray[np.float64]]:
+    """ Lower cell and weight of the upper cell for the height z of every point in its column levels (points,nz), clamped at the ends """
+    nz = levels.shape[-1]
+    upper = np.clip((levels < z[:,None]).sum(axis=-1), 1, nz-1)
+    lower = upper - 1
+    z0 = np.take_along_axis(levels, lower[:,None], axis=-1)[:,0]
+    z1 = np.take_along_axis(levels, upper[:,None], axis=-1)[:,0]
+    return lower, np.clip((z - z0) / (z1 - z0), 0, 1)
+
+
+def compile_section(section: Section, coord_centered: NDArray[np.float64], coord_ground: NDArray[np.float64]) -> InterpolationOperator:
+    """ The interpolation operator of the section on the grid, as saved by Grid.save """
+    points, above_ground, shape = section.points(coord_centered, coord_ground)
+    x_centers, y_centers = horizontal_axes(coord_centered)
+    nx, ny, nz = coord_centered.shape[:3]
+    levels = height_above_ground(coord_centered, coord_ground) if above_ground else coord_centered[:,:,:,2]
+
+    i, wx = axis_weights(x_centers, points[:,0])
+    j, wy = axis_weights(y_centers, points[:,1])
+    indices = np.empty((len(points), 8), dtype=np.int64)
+    weights = np.empty((len(points), 8))
+    bottom, top = np.zeros(len(points)), np.zeros(len(points))
+    for column, (di, dj, w) in enumerate([(0, 0, (1-wx)*(1-wy)), (1, 0, wx*(1-wy)), (0, 1, (1-wx)*wy), (1, 1, wx*wy)]):
+        ci, cj = i + di, j + dj
+        k, wz = _column_weights(levels[ci, cj], points[:,2])
+        # flat index of (k,ci,cj) in a (z,x,y) field
+        indices[:, 2*column] = (k*nx + ci)*ny + cj
+        indices[:, 2*column+1] = ((k+1)*nx + ci)*ny + cj
+        weights[:, 2*column] = w*(1 - wz)
+        weights[:, 2*column+1] = w*wz
+        bottom += w*levels[ci, cj, 0]
+        top += w*levels[ci, cj, -1]
+
+    inside = ((x_centers[0] <= points[:,0]) & (points[:,0] <= x_centers[-1])
+              & (y_centers[0] <= points[:,1]) & (points[:,1] <= y_centers[-1]))
+    if not above_ground:
+        # heights above ground are clamped to the first and last cell like analysis/heights.py, planes are cut by the terrain
+        inside &= (bottom <= points[:,2]) & (points[:,2] <= top)
+    absolute = points.copy()
+    if above_ground:
+        ground = np.zeros(len(points))
+        for di, dj, w in [(0, 0, (1-wx)*(1-wy)), (1, 0, wx*(1-wy)), (0, 1, (1-wx)*wy), (1, 1, wx*wy)]:
+            ground += w*coord_ground[i+di, j+dj]
+        absolute[:,2] += ground
+    return InterpolationOperator(indices, weights, shape, inside, absolute)
+
+
+_loaded: Dict[Path, InterpolationOperator] = {}
+_lock = threading.Lock()
+
+
+def load_operator(cache: SectorCache, sector: str, section: Section) -> InterpolationOperator:
+    """ The operator of the section on the grid of the sector, compiled once per grid and section and kept next to the grid """
+    path = cache.operator_path(sector, section.key)
+    with _lock:
+        if path not in _loaded:
+            if path.is_file():
+                _loaded[path] = InterpolationOperator.load(path)
+            else:
+                with np.load(cache.grid_path(sector)) as grid:
+                    operator = compile_section(section, grid['coord_centered'], grid['coord_ground'])
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temporary = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp.npz')
+                operator.save(temporary)
+                os.replace(temporary, path)
+                _loaded[path] = operator
+        return _loaded[path]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/maps.py
+
+"""
+Standard horizontal maps of a sector at hub heights above ground.
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..readers.dataset import Dataset
+from .heights import height_above_ground
+from .sections import horizontal_slice
+
+MAP_FIELDS = ('speed', 'direction', 'ti', 'inflow')
+
+
+def hub_height_maps(dataset: Dataset, heights: Iterable[float], fields: Iterable[str]=MAP_FIELDS) -> Dict[str, NDArray[np.float64]]:
+    """ Maps (x,y) named <field>_<height>m of the fields that are available in the dataset, and the coordinates x, y and elevation """
+    above_ground = height_above_ground(dataset.coord_centered, dataset.coord_ground)
+    maps = {
+        'x': dataset.coord_centered[:,:,0,0],
+        'y': dataset.coord_centered[:,:,0,1],
+        'elevation': dataset.coord_ground,
+    }
+    available = [field for field in fields if field in dataset.fields]
+    for field in available:
+        for height in heights:
+            maps[f'{field}_{height:g}m'] = horizontal_slice(dataset, field, height, above_ground)
+    return maps
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/sections.py
+
+"""
+Horizontal slices at a height above ground, vertical sections along a line and vertical profiles of
+the fields of a converted sector. The results are (x,y), (point,z) and (z,) arrays.
+"""
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..readers.dataset import Dataset
+from .heights import bilinear, height_above_ground, horizontal_axes, interpolate_to_height
+
+
+def interpolate_field(dataset: Dataset, field: str, interpolate: Callable[[NDArray[np.float64]], NDArray[np.float64]]) -> NDArray[np.float64]:
+    """ interpolate(values) on the field as (x,y,z). Directions are interpolated as unit vectors, the angle itself goes wrong across north """
+    values = np.moveaxis(dataset[field], 0, -1)
+    if field != 'direction':
+        return interpolate(values)
+    radians = np.radians(values)
+    east, north = interpolate(np.sin(radians)), interpolate(np.cos(radians))
+    return np.mod(np.degrees(np.arctan2(east, north)), 360)
+
+
+def horizontal_slice(dataset: Dataset, field: str, height: float, above_ground: Optional[NDArray[np.float64]]=None) -> NDArray[np.float64]:
+    """ The field at the height above ground, (x,y) """
+    if above_ground is None:
+        above_ground = height_above_ground(dataset.coord_centered, dataset.coord_ground)
+    return interpolate_field(dataset, field, lambda values: interpolate_to_height(values, above_ground, height))
+
+
+def vertical_section(dataset: Dataset, field: str, start: Tuple[float, float], end: Tuple[float, float], n: int=100) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """ The field and the height above sea of the cell centers at n points on the line from start to end, both (point,z) """
+    x_centers, y_centers = horizontal_axes(dataset.coord_centered)
+    x = np.linspace(start[0], end[0], n)
+    y = np.linspace(start[1], end[1], n)
+    values = interpolate_field(dataset, field, lambda values: bilinear(x_centers, y_centers, values, x, y, outer=False))
+    z = bilinear(x_centers, y_centers, dataset.coord_centered[:,:,:,2], x, y, outer=False)
+    return values, z
+
+
+def profile(dataset: Dataset, field: str, x: float, y: float) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """ The field and the height above ground of the cell centers in the column at x, y, both (z,) """
+    values, z = vertical_section(dataset, field, (x, y), (x, y), n=1)
+    x_centers, y_centers = horizontal_axes(dataset.coord_centered)
+    ground = bilinear(x_centers, y_centers, dataset.coord_ground, np.array([x]), np.array([y]), outer=False)
+    return values[0], z[0] - ground[0]
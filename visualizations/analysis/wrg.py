@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# analysis/wrg.py
+
+"""
+Native generation of WRG (wind resource grid) files from the converted sector fields.
+
+The climatology is transferred from its measurement point to every point of a regular grid with
+the speed-up of each sector: A_s(p) = A_s * speed_s(p, height) / speed_s(climatology point, climatology height),
+while the frequency and the shape factor k of the sector are kept. The speed of every sector at a
+height is interpolated once and shared by all climatologies, so many heights and climatologies
+are written in one pass without running WindResources for each of them.
+
+Example:
+    python -m visualizations.analysis.wrg --folder "<project>/my_documentation" --sectors 000 030 060 ... --climatologies climatologies.json --heights 50 100 --cellsize 25
+where climatologies.json is a list of {"name", "x", "y", "height", "frequency", "A", "k"}, with a value per sector for the last three.
+"""
+import json
+import math
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from ..readers.cache import SectorCache
+from ..readers.fields import FieldRegistry
+from .heights import bilinear, height_above_ground, horizontal_axes, interpolate_to_height
+
+AIR_DENSITY = 1.225
+
+
+class Climatology:
+    def __init__(self, name: str, x: float, y: float, height: float, frequency: Sequence[float], A: Sequence[float], k: Sequence[float]):
+        """ Sector-wise Weibull distribution measured at x, y and height above ground. The frequencies are normalized """
+        self.name = name
+        self.x = float(x)
+        self.y = float(y)
+        self.height = float(height)
+        self.frequency = np.asarray(frequency, dtype=float)
+        self.frequency = self.frequency / self.frequency.sum()
+        self.A = np.asarray(A, dtype=float)
+        self.k = np.asarray(k, dtype=float)
+        if not len(self.frequency) == len(self.A) == len(self.k):
+            raise ValueError(f'Climatology {name} needs frequency, A and k for every sector.')
+
+    @property
+    def n_sectors(self) -> int:
+        return len(self.frequency)
+
+    @classmethod
+    def from_json(cls, path: Path) -> List['Climatology']:
+        with open(path, 'r') as infile:
+            return [cls(**climatology) for climatology in json.load(infile)]
+
+
+@lru_cache(maxsize=1)
+def _weibull_table() -> Tuple[NDArray[np.float64], NDArray[np.float64], NDArray[np.float64]]:
+    # <u^3>/<u>^3 only depends on k, and decreases with k, so it is tabulated once and inverted with np.interp
+    k = np.linspace(0.5, 15, 3000)
+    gamma1 = np.array([math.gamma(1 + 1/ki) for ki in k])
+    gamma3 = np.array([math.gamma(1 + 3/ki) for ki in k])
+    return k, gamma1, gamma3 / gamma1**3
+
+
+def fit_weibull(mean: NDArray[np.float64], mean_cubed: NDArray[np.float64]) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+    """ The Weibull A and k with the same mean speed and mean cubed speed (energy) """
+    k_table, gamma1, ratio = _weibull_table()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.interp(mean_cubed / mean**3, ratio[::-1], k_table[::-1])
+    A = mean / np.interp(k, k_table, gamma1)
+    return A, k
+
+
+class WRGGenerator:
+    def __init__(self, coord_centered: NDArray[np.float64], coord_ground: NDArray[np.float64], sectors: Sequence[FieldRegistry]):
+        """
+        coord_centered, coord_ground: the grid as saved by Grid.save
+        sectors: the fields of every sector, in the same order as the sectors of the climatologies
+        """
+        self.heights = height_above_ground(coord_centered, coord_ground)
+        self.x_centers, self.y_centers = horizontal_axes(coord_centered)
+        self.ground = coord_ground
+        self.sectors = list(sectors)
+        self._speed_maps: Dict[float, NDArray[np.float64]] = {}
+
+    @classmethod
+    def from_folder(cls, folder: Path, sectors: Sequence[str]) -> 'WRGGenerator':
+        """ From the sectors in the cache folder, see readers/cache.py, all sectors share the grid """
+        cache = SectorCache(folder)
+        datasets = [cache.load(sector) for sector in sectors]
+        return cls(datasets[0].coord_centered, datasets[0].coord_ground, [dataset.fields for dataset in datasets])
+
+    def output_grid(self, cellsize: float, bounds: Optional[Tuple[float, float, float, float]]=None) -> Tuple[NDArray[np.float64], NDArray[np.float64]]:
+        """ Regular grid with the given cellsize, within bounds (xmin, xmax, ymin, ymax) or within the cell centers """
+        xmin, xmax, ymin, ymax = bounds or (self.x_centers[0], self.x_centers[-1], self.y_centers[0], self.y_centers[-1])
+        x = xmin + cellsize*np.arange(int(np.floor((xmax - xmin)/cellsize)) + 1)
+        y = ymin + cellsize*np.arange(int(np.floor((ymax - ymin)/cellsize)) + 1)
+        return x, y
+
+    def speed_maps(self, height: float) -> NDArray[np.float64]:
+        """ Horizontal speed of all sectors at the height above ground on the columns of the grid, (sector,x,y) """
+        if height not in self._speed_maps:
+            self._speed_maps[height] = np.stack([interpolate_to_height(np.moveaxis(fields['speed'], 0, -1), self.heights, height) for fields in self.sectors])
+        return self._speed_maps[height]
+
+    def point_speeds(self, x: float, y: float, height: float) -> NDArray[np.float64]:
+        """ Speed of all sectors at a single point, (sector,) """
+        maps = np.moveaxis(self.speed_maps(height), 0, -1)
+        return bilinear(self.x_centers, self.y_centers, maps, np.array([x]), np.array([y]), outer=False)[0]
+
+    def resource(self, climatology: Climatology, height: float, x: NDArray[np.float64], y: NDArray[np.float64]) -> Dict[str, NDArray[np.float64]]:
+        """ Sector-wise and all-sector Weibull parameters and power density of the climatology on the regular grid x, y """
+        if climatology.n_sectors != len(self.sectors):
+            raise ValueError(f'Climatology {climatology.name} has {climatology.n_sectors} sectors, the fields have {len(self.sectors)}.')
+
+        reference = self.point_speeds(climatology.x, climatology.y, climatology.height)
+        speeds = bilinear(self.x_centers, self.y_centers, np.moveaxis(self.speed_maps(height), 0, -1), x, y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            A = climatology.A * np.where(reference > 0, speeds / reference, 1.0)
+
+        gamma1 = np.array([math.gamma(1 + 1/k) for k in climatology.k])
+        gamma3 = np.array([math.gamma(1 + 3/k) for k in climatology.k])
+        mean = (climatology.frequency * A * gamma1).sum(axis=-1)
+        mean_cubed = (climatology.frequency * A**3 * gamma3).sum(axis=-1)
+        A_all, k_all = fit_weibull(mean, mean_cubed)
+
+        return {
+            'elevation': bilinear(self.x_centers, self.y_centers, self.ground, x, y),
+            'A_all': A_all,
+            'k_all': k_all,
+            'power_density': 0.5*AIR_DENSITY*mean_cubed,
+            'A': A,
+        }
+
+    def write(self, folder: Path, climatologies: Iterable[Climatology], heights: Iterable[float], cellsize: float, bounds: Optional[Tuple[float, float, float, float]]=None) -> List[Path]:
+        """ Writes <climatology>_<height>m.wrg for every climatology and height into folder """
+        folder.mkdir(parents=True, exist_ok=True)
+        climatologies = list(climatologies)
+        x, y = self.output_grid(cellsize, bounds)
+        paths = []
+        for height in heights:
+            for climatology in climatologies:
+                path = folder / f'{climatology.name}_{height:g}m.wrg'
+                print(f'Writing {path}')
+                write_wrg(path, x, y, height, climatology, self.resource(climatology, height, x, y), cellsize)
+                paths.append(path)
+            # The maps of a height are not needed anymore once all climatologies are written
+            self._speed_maps.pop(height, None)
+        return paths
+
+
+def write_wrg(path: Path, x: NDArray[np.float64], y: NDArray[np.float64], height: float, climatology: Climatology, resource: Dict[str, NDArray[np.float64]], cellsize: float) -> None:
+    """ Writes the resource in the fixed column WRG format, the points are ordered with y changing fastest """
+    nx, ny, nsec = len(x), len(y), climatology.n_sectors
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    frequency = np.broadcast_to(np.rint(climatology.frequency*1000), (nx, ny, nsec))
+    k = np.broadcast_to(np.rint(climatology.k*100), (nx, ny, nsec))
+    A = np.rint(resource['A']*10)
+
+    columns = [X, Y, resource['elevation'], np.full((nx, ny), height), resource['A_all'], resource['k_all'], resource['power_density'], np.full((nx, ny), nsec)]
+    sectors = np.stack([frequency, A, k], axis=-1).reshape(nx, ny, 3*nsec)
+    rows = np.concatenate([np.stack(columns, axis=-1), sectors], axis=-1).reshape(nx*ny, -1)
+
+    row_format = 'GridPoint %10.1f%10.1f%8.1f%5.1f%5.2f%6.3f%15.3e%3d' + '%4d%4d%5d'*nsec
+    with open(path, 'w') as outfile:
+        outfile.write(f'{nx:>6d}{ny:>6d}{x[0]:>14.1f}{y[0]:>14.1f}{cellsize:>12.1f}\n')
+        outfile.write('\n'.join(row_format % tuple(row) for row in rows.tolist()))
+        outfile.write('\n')
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Write WRG files for several climatologies and heights from converted sector fields.")
+    parser.add_argument('-f', '--folder', type=str, required=True, help='Folder with the converted sectors, see readers/cache.py.')
+    parser.add_argument('-s', '--sectors', type=str, nargs='+', required=True, help='The sectors, in the same order as the sectors of the climatologies.')
+    parser.add_argument('-c', '--climatologies', type=str, required=True, help='Json file with a list of climatologies.')
+    parser.add_argument('--heights', type=float, nargs='+', required=True, help='Heights above ground to write.')
+    parser.add_argument('--cellsize', type=float, required=True, help='Cell size of the resource grid.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Output folder, default is the folder of the fields.')
+
+    args = parser.parse_args()
+    folder = Path(args.folder)
+    generator = WRGGenerator.from_folder(folder, args.sectors)
+    generator.write(Path(args.output) if args.output else folder, Climatology.from_json(Path(args.climatologies)), args.heights, args.cellsize)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+"""
+Lazy imports of the plotting libraries.
+
+pyvista (with vtk) and matplotlib take most of the import time of the package, and need a display
+capable stack. The readers, the cache, the analysis and the pipeline never import them, the viewers
+import them through these functions on first use, so converting files on a cluster stays headless.
+"""
+from types import ModuleType
+
+_theme_set = False
+
+
+def pyvista() -> ModuleType:
+    """ pyvista, with the theme of the 3D views set on the first call """
+    global _theme_set
+    import pyvista as pv
+    if not _theme_set:
+        pv.global_theme.axes.box = True
+        pv.global_theme.axes.show = True
+        _theme_set = True
+    return pv
+
+
+def pyplot() -> ModuleType:
+    import matplotlib.pyplot as plt
+    return plt
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+"""
+Level-of-detail support for the interactive 3D views in visualizations.py
+
+The full resolution grids of large projects have millions of cells, and a vtk slice of
+them takes long enough to stall the UI on every slider callback. LevelOfDetail keeps
+strided copies of the terrain and the field grid, so the coarse copy can be sliced while
+the user is dragging and the full resolution slice swapped in when the interaction stops.
+"""
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .backends import pyvista
+from .readers.lru import LRUCache
+
+if TYPE_CHECKING:
+    import pyvista as pv
+
+
+def _strided_index(n: int, stride: int) -> NDArray[np.int64]:
+    """ Every stride'th index, always keeping the last one so the bounds of the grid are preserved """
+    index = np.arange(0, n, stride)
+    if index[-1] != n-1:
+        index = np.append(index, n-1)
+    return index
+
+
+class LevelOfDetail:
+    def __init__(self, coords: NDArray[np.float64], full: Optional['pv.StructuredGrid']=None, z_scale: float=7, min_points: int=100_000, max_levels: int=4, cache_size: int=32):
+        """
+        coords: cell centered coordinates with shape (x,y,z,3), as stored in coord_centered
+        full: the full resolution grid if it already exists, level 0 is then shared with the caller
+        min_points: no coarser levels are made once a level is below this number of points
+        """
+        self.coords = coords
+        self.z_scale = z_scale
+        nx, ny, nz = coords.shape[:3]
+
+        #Only the horizontal directions are decimated, the vertical resolution is low already and is needed for the profiles
+        self.index: List[Tuple[NDArray[np.int64], NDArray[np.int64], NDArray[np.int64]]] = [(np.arange(nx), np.arange(ny), np.arange(nz))]
+        stride = 1
+        while len(self.index) < max_levels and self.n_points(len(self.index)-1) > min_points:
+            stride *= 2
+            self.index.append((_strided_index(nx, stride), _strided_index(ny, stride), np.arange(nz)))
+
+        self.grids: List['pv.StructuredGrid'] = [full if full is not None else self._structured_grid(0)]
+        self.grids.extend(self._structured_grid(level) for level in range(1, len(self.index)))
+        self.terrains: List['pv.StructuredGrid'] = [self._terrain(level) for level in range(len(self.index))]
+
+        self._slices = LRUCache(maxsize=cache_size)
+
+    @property
+    def coarsest(self) -> int:
+        return len(self.index) - 1
+
+    def n_points(self, level: int) -> int:
+        ix, iy, iz = self.index[level]
+        return len(ix) * len(iy) * len(iz)
+
+    def n_terrain_points(self, level: int) -> int:
+        ix, iy, _ = self.index[level]
+        return len(ix) * len(iy)
+
+    def level_below(self, max_points: int, terrain: bool=False) -> int:
+        """ The finest level with at most max_points points in the field grid, or in the terrain surface, or the coarsest level """
+        n_points = self.n_terrain_points if terrain else self.n_points
+        for level in range(len(self.index)):
+            if n_points(level) <= max_points:
+                return level
+        return self.coarsest
+
+    def _decimate(self, array: NDArray, level: int) -> NDArray:
+        ix, iy, iz = self.index[level]
+        return array[np.ix_(ix, iy, iz)]
+
+    def _structured_grid(self, level: int) -> 'pv.StructuredGrid':
+        x = self._decimate(self.coords[:,:,:,0], level)
+        y = self._decimate(self.coords[:,:,:,1], level)
+        z = self._decimate(self.coords[:,:,:,2], level)
+        return pyvista().StructuredGrid(x, y, z*self.z_scale)
+
+    def _terrain(self, level: int) -> 'pv.StructuredGrid':
+        ix, iy, _ = self.index[level]
+        ground = self.coords[np.ix_(ix, iy)][:,:,0,:]
+        terrain = pyvista().StructuredGrid(ground[:,:,0], ground[:,:,1], ground[:,:,2]*self.z_scale)
+        terrain['Elevation'] = terrain.points[:,2]
+        return terrain
+
+    def set_field(self, variable: str, field: NDArray[np.float64]) -> None:
+        """ Sets the field (x,y,z ordered like coords) on all the levels """
+        for level, grid in enumerate(self.grids):
+            grid[variable] = self._decimate(field, level).flatten(order='F')
+        self._slices.clear()
+
+    def slice(self, level: int, origin: Tuple[float, float, float], normal: str='y') -> 'pv.PolyData':
+        """ Slices the grid at the given level. The results of recently visited positions are cached """
+        grid = self.grids[level]
+        key = (level, grid.active_scalars_name, normal, tuple(np.round(origin, 3)))
+        result = self._slices.get(key)
+        if result is None:
+            result = grid.slice(origin=origin, normal=normal)
+            self._slices[key] = result
+        return result
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+"""
+Post-processing of the sectors while WindFields is still running.
+
+SectorPipeline watches the windfield folder of a project. As soon as both the .phi and the .xyz file of a
+sector exist and have stopped changing, the sector is converted into the cache (readers/cache.py) and the
+hub height maps are computed, in a pool of worker processes, while the other sectors are still solving.
+The watcher polls the folder, and the runner can wake it up when a sector has finished,
+pipeline.on_sector_done fits the on_sector_done hook of WindSimRunner.run_WindField in batch-mode/batch_mode.py.
+
+Example:
+    python -m visualizations.pipeline --windfield "<project>/windfield" --cache "<project>/my_documentation" --heights 80 100
+"""
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .analysis.maps import hub_height_maps
+from .readers.cache import SectorCache
+from .readers.grid_store import GridStore
+
+
+def process_sector(windfield: Path, folder: Path, grids: Path, sector: str, heights: Tuple[float, ...], read_workers: int=1) -> str:
+    """ Converts a sector into the cache and stores its hub height maps, if any heights are given, runs in a worker process """
+    cache = SectorCache(folder, GridStore(grids))
+    dataset = cache.convert(sector, windfield, workers=read_workers)
+    if heights:
+        cache.save_maps(sector, hub_height_maps(dataset, heights))
+    return sector
+
+
+class SectorPipeline:
+    def __init__(self, windfield: Path, cache: SectorCache, heights: Iterable[float]=(100,), max_workers: int=2, poll_interval: float=10):
+        """
+        windfield: the windfield folder of the project, where WindFields writes <sector>.phi and <sector>.xyz
+        heights: heights above ground of the hub height maps
+        poll_interval: seconds between the scans of the windfield folder, a sector is processed when its files are unchanged for that long,
+            however often the folder is scanned in between
+        """
+        self.windfield = windfield
+        self.cache = cache
+        self.heights = tuple(heights)
+        self.poll_interval = poll_interval
+        self.futures: Dict[str, Future] = {}
+        # the sectors whose conversion raised, with the exception
+        self.failed: Dict[str, BaseException] = {}
+        self._pool = ProcessPoolExecutor(max_workers=max_workers)
+        # the signature of the files of a sector and since when it has not changed
+        self._seen: Dict[str, Tuple[Tuple[int, float, int, float], float]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'SectorPipeline':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.stop(cancel=exc_type is not None)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._watch, name='SectorPipeline', daemon=True)
+        self._thread.start()
+
+    def _watch(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except Exception as error:
+                # i.e. the folder is briefly not reachable, try again at the next poll
+                print(f'Scanning {self.windfield} failed: {error!r}')
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def notify(self) -> None:
+        """ Scan the windfield folder now instead of at the next poll """
+        self._wake.set()
+
+    def on_sector_done(self, project_name: str, sector: str, result) -> None:
+        """ Hook for the runner, called when the WindFields job of a sector has finished """
+        self.notify()
+
+    def _signature(self, sector: str) -> Optional[Tuple[int, float, int, float]]:
+        try:
+            phi = (self.windfield / f'{sector}.phi').stat()
+            xyz = (self.windfield / f'{sector}.xyz').stat()
+        except FileNotFoundError:
+            return None
+        return (phi.st_size, phi.st_mtime, xyz.st_size, xyz.st_mtime)
+
+    def scan(self) -> List[str]:
+        """ Submits the sectors whose files are complete and unchanged since the last scan, returns the submitted sectors """
+        with self._lock:
+            return self._scan()
+
+    def _scan(self) -> List[str]:
+        submitted = []
+        for phi in sorted(self.windfield.glob('*.phi')):
+            sector = phi.stem
+            if sector in self.futures:
+                continue
+            signature = self._signature(sector)
+            if signature is None:
+                continue
+            if self.cache.is_fresh(sector, self.windfield):
+                print(f'Sector {sector} is already in the cache')
+                self.futures[sector] = Future()
+                self.futures[sector].set_result(sector)
+                continue
+            seen, since = self._seen.get(sector, (None, 0.0))
+            if seen != signature:
+                self._seen[sector] = (signature, time.monotonic())
+            elif time.monotonic() - since >= self.poll_interval:
+                print(f'Sector {sector} is complete, converting it')
+                future = self._pool.submit(process_sector, self.windfield, self.cache.folder, self.cache.grid_store.folder, sector, self.heights)
+                future.add_done_callback(lambda future, sector=sector: self._done(sector, future))
+                self.futures[sector] = future
+                submitted.append(sector)
+        return submitted
+
+    def _done(self, sector: str, future: Future) -> None:
+        if future.cancelled() or future.exception() is None:
+            return
+        print(f'Sector {sector} failed: {future.exception()!r}')
+        self.failed[sector] = future.exception()
+
+    def wait(self, sectors: Optional[Iterable[str]]=None, timeout: Optional[float]=None) -> List[str]:
+        """ Waits until the given sectors, or all sectors found so far, are processed. Returns the processed sectors, the failed ones are in self.failed """
+        sectors = list(sectors) if sectors is not None else list(self.futures)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # The sectors may not have been found yet, so wait for them to show up first
+        while any(sector not in self.futures for sector in sectors):
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            self.notify()
+            time.sleep(min(1, self.poll_interval))
+        futures = [self.futures[sector] for sector in sectors if sector in self.futures]
+        wait(futures, timeout=None if deadline is None else max(0, deadline - time.monotonic()))
+        return [future.result() for future in futures if future.done() and not future.cancelled() and future.exception() is None]
+
+    def stop(self, cancel: bool=False) -> None:
+        """ Stops watching, and waits for the sectors that are being processed unless cancel is True """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown(wait=True, cancel_futures=cancel)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert the sectors of a project as WindFields finishes them.")
+    parser.add_argument('-w', '--windfield', type=str, required=True, help='The windfield folder of the project.')
+    parser.add_argument('-c', '--cache', type=str, required=True, help='Folder of the converted sectors, i.e. <project>/my_documentation.')
+    parser.add_argument('-g', '--grids', type=str, default=None, help='Grid store shared by several projects, default is <cache>/grids.')
+    parser.add_argument('--heights', type=float, nargs='+', default=[100], help='Heights above ground of the hub height maps.')
+    parser.add_argument('--workers', type=int, default=2, help='Number of sectors converted at the same time.')
+    parser.add_argument('--poll', type=float, default=10, help='Seconds between the scans of the windfield folder.')
+    parser.add_argument('--sectors', type=str, nargs='+', default=None, help='Stop when these sectors are processed, default is to watch until interrupted.')
+
+    args = parser.parse_args()
+    cache = SectorCache(Path(args.cache), GridStore(Path(args.grids)) if args.grids else None)
+    with SectorPipeline(Path(args.windfield), cache, heights=args.heights, max_workers=args.workers, poll_interval=args.poll) as pipeline:
+        if args.sectors:
+            pipeline.wait(args.sectors)
+        else:
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                print('Stopping, waiting for the sectors being converted')
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/archive.py
+
+"""
+Chunked archive format for the archival copies of converted sectors.
+
+np.savez_compressed compresses every array as one zlib stream on a single core. The archive splits
+every array into chunks of whole rows (the last two axes, i.e. one (z) slab of a phi field, the rows of
+a 2-D array) and compresses the chunks in a thread pool. zlib and lzma release the GIL, so writing and
+reading scale with the number of cores. An index with the offset of every chunk allows reading single
+chunks or row ranges without decompressing the rest of the array.
+
+Layout of the file:
+    b'WSARCH01'                 magic
+    chunks                      the compressed chunks of all arrays, one after the other
+    index                       json: codec, level, attrs and for every array dtype, shape, row_size, chunk_rows and [offset, length] of the chunks
+    <u8 index offset, b'WSARCH01'
+"""
+import json
+import lzma
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+MAGIC = b'WSARCH01'
+TRAILER = struct.Struct('<Q8s')
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+    'none': (lambda data, level: bytes(data), bytes),
+}
+
+
+def row_size(shape: Sequence[int]) -> int:
+    """ Values in a row, from the shape only: the last two axes, i.e. one (z) slab of a phi field, the rows of a 2-D array or single values """
+    return int(np.prod(shape[-2:])) if len(shape) >= 3 else int(np.prod(shape[1:]))
+
+
+def _rows(array: NDArray) -> NDArray:
+    """ The array as rows, (rows, row size), arrays without values have no rows """
+    if array.size == 0:
+        return np.empty((0, row_size(array.shape)), dtype=array.dtype)
+    return np.ascontiguousarray(array).reshape(-1, row_size(array.shape))
+
+
+def save_archive(path: Path, arrays: Mapping[str, NDArray], attrs: Optional[Dict[str, Any]]=None, codec: str='zlib', level: int=6, chunk_bytes: int=4*1024**2, workers: Optional[int]=None) -> None:
+    """
+    Writes the arrays to a chunked archive.
+    attrs: json serializable values stored in the index, i.e. the field names
+    codec: 'zlib' (level 0-9), 'lzma' (level 0-9) or 'none'
+    chunk_bytes: the uncompressed size of a chunk, rounded to whole rows
+    """
+    compress, _ = CODECS[codec]
+    index: Dict[str, Any] = {'codec': codec, 'level': level, 'attrs': attrs or {}, 'arrays': {}}
+    with open(path, 'wb') as outfile, ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        outfile.write(MAGIC)
+        for name, array in arrays.items():
+            array = np.asarray(array)
+            rows = _rows(array)
+            chunk_rows = max(1, chunk_bytes // max(rows.shape[1]*array.itemsize, 1))
+            chunks = [rows[start:start+chunk_rows] for start in range(0, len(rows), chunk_rows)]
+            locations: List[Tuple[int, int]] = []
+            # map keeps the order of the chunks, so they are written as they are ready
+            for blob in pool.map(lambda chunk: compress(memoryview(chunk).cast('B'), level), chunks):
+                locations.append((outfile.tell(), len(blob)))
+                outfile.write(blob)
+            index['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'row_size': rows.shape[1], 'chunk_rows': chunk_rows, 'chunks': locations}
+
+        index_offset = outfile.tell()
+        outfile.write(json.dumps(index).encode())
+        outfile.write(TRAILER.pack(index_offset, MAGIC))
+
+
+class Archive:
+    def __init__(self, path: Path, workers: Optional[int]=None):
+        self.path = path
+        self.workers = workers or os.cpu_count()
+        self._file = open(path, 'rb')
+        self._lock = threading.Lock()
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not an archive.')
+        self._file.seek(-TRAILER.size, os.SEEK_END)
+        index_offset, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is truncated, the index is missing.')
+        index_end = self._file.seek(0, os.SEEK_END) - TRAILER.size
+        self._file.seek(index_offset)
+        self.index = json.loads(self._file.read(index_end - index_offset))
+        self.attrs: Dict[str, Any] = self.index['attrs']
+        _, self._decompress = CODECS[self.index['codec']]
+
+    def __enter__(self) -> 'Archive':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    @property
+    def files(self) -> List[str]:
+        return list(self.index['arrays']) + list(self.attrs)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.files)
+
+    def shape(self, name: str) -> Tuple[int, ...]:
+        return tuple(self.index['arrays'][name]['shape'])
+
+    def dtype(self, name: str) -> np.dtype:
+        return np.dtype(self.index['arrays'][name]['dtype'])
+
+    def n_chunks(self, name: str) -> int:
+        return len(self.index['arrays'][name]['chunks'])
+
+    def chunk_rows(self, name: str) -> int:
+        return self.index['arrays'][name]['chunk_rows']
+
+    def _read_blobs(self, name: str, first: int, last: int) -> List[memoryview]:
+        """ The compressed chunks first to last (inclusive), with one read since they are stored one after the other """
+        chunks = self.index['arrays'][name]['chunks'][first:last+1]
+        start = chunks[0][0]
+        with self._lock:
+            self._file.seek(start)
+            data = memoryview(self._file.read(chunks[-1][0] + chunks[-1][1] - start))
+        return [data[offset-start:offset-start+length] for offset, length in chunks]
+
+    def read_chunk(self, name: str, chunk: int) -> NDArray:
+        """ A single chunk as rows, (rows, row size), see row_size """
+        blob, = self._read_blobs(name, chunk, chunk)
+        return np.frombuffer(self._decompress(blob), dtype=self.dtype(name)).reshape(-1, self._row_size(name))
+
+    def _row_size(self, name: str) -> int:
+        spec = self.index['arrays'][name]
+        if 'row_size' in spec:
+            return spec['row_size']
+        # archives written before the row size was stored
+        shape = spec['shape']
+        return int(np.prod(shape[-2:])) if len(shape) >= 2 else max(int(np.prod(shape)), 1)
+
+    def n_rows(self, name: str) -> int:
+        row_size = self._row_size(name)
+        shape = self.shape(name)
+        if row_size == 0:
+            return shape[0] if shape else 0
+        return int(np.prod(shape)) // row_size
+
+    def read_rows(self, name: str, start: int, stop: int) -> NDArray:
+        """ Rows start to stop of the array, see row_size, only the chunks needed are decompressed. Like a slice, the range is clipped to the rows there are """
+        n_rows = self.n_rows(name)
+        start = min(max(start, 0), n_rows)
+        stop = min(max(stop, start), n_rows)
+        rows = np.empty((stop - start, self._row_size(name)), dtype=self.dtype(name))
+        if rows.size == 0:
+            return rows
+        chunk_rows = self.chunk_rows(name)
+        first, last = start // chunk_rows, (stop - 1) // chunk_rows
+
+        def decompress(item):
+            chunk, blob = item
+            data = np.frombuffer(self._decompress(blob), dtype=rows.dtype).reshape(-1, rows.shape[1])
+            chunk_start = chunk*chunk_rows
+            lo, hi = max(start, chunk_start), min(stop, chunk_start + len(data))
+            rows[lo-start:hi-start] = data[lo-chunk_start:hi-chunk_start]
+
+        blobs = self._read_blobs(name, first, last)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(decompress, zip(range(first, last+1), blobs)))
+        return rows
+
+    def read(self, name: str) -> NDArray:
+        """ The whole array, the chunks are decompressed in parallel """
+        shape = self.shape(name)
+        size = int(np.prod(shape))
+        if size == 0 or self.n_chunks(name) == 0:
+            return np.empty(shape, dtype=self.dtype(name))
+        return self.read_rows(name, 0, self.n_rows(name)).reshape(shape)
+
+    def __getitem__(self, name: str) -> Any:
+        # The attributes are given as arrays too, so an archive can be used like the loaded npz files
+        if name in self.attrs:
+            return np.asarray(self.attrs[name])
+        return self.read(name)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/cache.py
+
+"""
+The cache of converted sectors, by default the my_documentation folder of the project.
+
+For a sector <sector> in the windfield folder (<sector>.phi and <sector>.xyz) the cache holds
+    <sector>.grid       the hash of the grid in the grid store, see readers/grid_store.py
+    <sector>.phi.npz    the fields, see Phi.save
+    <sector>.maps.npz   horizontal maps at hub heights, see analysis/maps.py
+    <hash>.geom.npz     in the grid store, the cell volumes and face areas of the grid, see analysis/geometry.py
+    <hash>.<key>.op.npz in the grid store, interpolation operators of sections, see analysis/interpolation.py
+The grids are kept in the grid store, <cache>/grids by default. The store can be shared by several
+caches, i.e. all variants of a project, so identical grids are converted and stored once.
+Caches written before the grid store, with the grid in <sector>.xyz.npz, are still read.
+"""
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .dataset import Dataset
+from .fields import FieldRegistry
+from .grid_store import GridStore
+from .phi_reader import Phi
+
+
+class SectorCache:
+    def __init__(self, folder: Path, grid_store: Optional[GridStore]=None):
+        self.folder = folder
+        self.grid_store = grid_store or GridStore(folder / 'grids')
+
+    def reference_path(self, sector: str) -> Path:
+        return self.folder / f'{sector}.grid'
+
+    def grid_hash(self, sector: str) -> Optional[str]:
+        reference = self.reference_path(sector)
+        return reference.read_text().strip() if reference.is_file() else None
+
+    def grid_path(self, sector: str) -> Path:
+        grid_hash = self.grid_hash(sector)
+        if grid_hash is None:
+            return self.folder / f'{sector}.xyz.npz'
+        return self.grid_store.path(grid_hash)
+
+    def geometry_path(self, sector: str) -> Path:
+        """ The cell geometry of the grid, see analysis/geometry.py, next to the grid in the store """
+        grid_hash = self.grid_hash(sector)
+        if grid_hash is None:
+            return self.folder / f'{sector}.geom.npz'
+        return self.grid_store.folder / f'{grid_hash}.geom.npz'
+
+    def operator_path(self, sector: str, key: str) -> Path:
+        """ An interpolation operator on the grid, see analysis/interpolation.py, next to the grid in the store """
+        grid_hash = self.grid_hash(sector)
+        if grid_hash is None:
+            return self.folder / f'{sector}.{key}.op.npz'
+        return self.grid_store.folder / f'{grid_hash}.{key}.op.npz'
+
+    def phi_path(self, sector: str) -> Path:
+        return self.folder / f'{sector}.phi.npz'
+
+    def maps_path(self, sector: str) -> Path:
+        return self.folder / f'{sector}.maps.npz'
+
+    def sectors(self) -> List[str]:
+        """ The sectors with both grid and fields in the cache """
+        return sorted(path.name[:-len('.phi.npz')] for path in self.folder.glob('*.phi.npz') if self.grid_path(path.name[:-len('.phi.npz')]).is_file())
+
+    def is_fresh(self, sector: str, windfield: Path) -> bool:
+        """ The cached sector is newer than the phi and xyz files in the windfield folder """
+        cached = [self.grid_path(sector), self.phi_path(sector)]
+        sources = [windfield / f'{sector}.xyz', windfield / f'{sector}.phi']
+        if not all(path.is_file() for path in cached):
+            return False
+        # A grid in the store may be older than the sources when it is shared, the reference tells when the sector was converted
+        if self.reference_path(sector).is_file():
+            cached = [self.reference_path(sector), self.phi_path(sector)]
+        return min(path.stat().st_mtime for path in cached) >= max(path.stat().st_mtime for path in sources if path.is_file())
+
+    def convert(self, sector: str, windfield: Path, workers: int=1) -> Dataset:
+        """ Reads <sector>.xyz and <sector>.phi, the latter with workers processes, from the windfield folder and stores them in the cache. Returns the sector without reading the cache back """
+        self.folder.mkdir(parents=True, exist_ok=True)
+        grid_hash = self.grid_store.add(windfield / f'{sector}.xyz')
+
+        phi = Phi()
+        phi.read(windfield / f'{sector}.phi', workers=workers)
+        phi.save(path=self.phi_path(sector))
+        self.reference_path(sector).write_text(grid_hash)
+        # the fields and the grid are in memory already, reading the files back would decompress them again
+        return Dataset(sector, self.grid_store.load(grid_hash), phi.fields, grid_hash=grid_hash)
+
+    def load(self, sector: str) -> Dataset:
+        grid_hash = self.grid_hash(sector)
+        if grid_hash is None:
+            return Dataset.load(sector, self.grid_path(sector), self.phi_path(sector))
+        return Dataset(sector, self.grid_store.load(grid_hash), FieldRegistry.from_npz(np.load(self.phi_path(sector))), grid_hash=grid_hash)
+
+    def save_maps(self, sector: str, maps: Dict[str, NDArray[np.float64]]) -> None:
+        np.savez_compressed(self.maps_path(sector), **maps)
+
+    def load_maps(self, sector: str) -> Dict[str, NDArray[np.float64]]:
+        return dict(np.load(self.maps_path(sector)))
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/catalog.py
+
+"""
+SQLite catalog of a tree of WindSim projects, so questions like "which 20 m/s actuator disk variants are
+solved" are answered without walking the directories and parsing the files again.
+
+For every project (.ws file) the catalog keeps the project parameters, the layouts (.lws) and the solved
+sectors of the windfield folder with the header of the .phi file (NX, NY, NZ and the field names), the
+sizes and modification times of the files, and the cache of converted sectors with whether it is up to
+date. A scan only parses the files that changed since the last scan, by size and modification time, and
+removes the entries of files that are gone. A file that can not be parsed is reported and skipped, a .phi
+file that is not complete yet, i.e. still being written by the solver, is kept with complete 0 and does
+not count as solved.
+
+    with Catalog(Path('catalog.sqlite')) as catalog:
+        catalog.scan(Path('C:/Users/<user>/Documents/WindSim Projects 12'))
+        catalog.projects(windspeed=20, actuator_disk=True, solved=True)
+"""
+import json
+import mmap
+import sqlite3
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .cache import SectorCache
+from .phi_reader import Phi, slab_layout
+
+# bumped when the tables change, the catalog is made again by the next scan
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    path TEXT PRIMARY KEY, name TEXT, folder TEXT, size INTEGER, mtime REAL,
+    sectors TEXT, n_sectors INTEGER, parallel_cores INTEGER, windspeed REAL, actuator_disk INTEGER, parameters TEXT
+);
+CREATE TABLE IF NOT EXISTS layouts (
+    path TEXT PRIMARY KEY, project TEXT, name TEXT, size INTEGER, mtime REAL, heights TEXT, climatologies TEXT
+);
+CREATE TABLE IF NOT EXISTS sectors (
+    project TEXT, sector TEXT, phi_path TEXT, phi_size INTEGER, phi_mtime REAL, xyz_path TEXT, xyz_size INTEGER, xyz_mtime REAL,
+    nx INTEGER, ny INTEGER, nz INTEGER, fields TEXT, complete INTEGER, error TEXT, cache TEXT, cached INTEGER, fresh INTEGER, grid_hash TEXT,
+    PRIMARY KEY (project, sector)
+);
+CREATE INDEX IF NOT EXISTS layouts_project ON layouts (project);
+"""
+
+JSON_COLUMNS = ('sectors', 'parameters', 'heights', 'climatologies', 'fields')
+
+# what reading a partial or garbage .ws, .lws or .phi file raises
+PARSE_ERRORS = (OSError, ValueError, TypeError, IndexError, ET.ParseError)
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit('}', 1)[-1]
+
+
+def read_project_parameters(project_file: Path) -> Dict[str, Any]:
+    """ The leaf elements of the .ws file by name, repeated elements (the sectors) as lists """
+    root = ET.parse(project_file).getroot()
+    parameters: Dict[str, Any] = {}
+    for element in root.iter():
+        if len(element) or element.text is None:
+            continue
+        name, value = _local(element.tag), element.text.strip()
+        if name in parameters:
+            if not isinstance(parameters[name], list):
+                parameters[name] = [parameters[name]]
+            parameters[name].append(value)
+        else:
+            parameters[name] = value
+    return parameters
+
+
+def _as_list(value: Any) -> List[str]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _float(value: Any) -> Optional[float]:
+    try:
+        return float(_as_list(value)[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_phi_header(phi_path: Path) -> Dict[str, Any]:
+    """ NX, NY, NZ and the field names of a .phi file, complete if the file has all the slabs the header announces """
+    phi = Phi()
+    with open(phi_path, 'r') as phiFile:
+        offset = phi.readHeader(phiFile, verbose=False)
+    n, n_slabs = phi.nx*phi.ny, phi.nz*len(phi.FieldNames)
+    with open(phi_path, 'rb') as binaryFile, mmap.mmap(binaryFile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if n_slabs == 0:
+            # the header ends before the stored fields, the readers of the header lines return nothing past the end
+            complete = False
+        elif slab_layout(mm, offset, n, n_slabs) is not None:
+            complete = True
+        else:
+            # slabs of different sizes, i.e. a file edited by hand, every slab has the same number of lines
+            complete = mm[offset:].count(b'\n') >= n_slabs*((n + 5)//6)
+    return {'nx': phi.nx, 'ny': phi.ny, 'nz': phi.nz, 'fields': [name.strip() for name in phi.FieldNames], 'complete': complete}
+
+
+def _sector_key(sector: str) -> Any:
+    """ The .ws file has sectors like '90', the windfield folder files like '090.phi' """
+    try:
+        return float(sector)
+    except ValueError:
+        return sector
+
+
+class Catalog:
+    def __init__(self, path: Path, cache_folder: str='my_documentation'):
+        """
+        path: the database file, made if it does not exist
+        cache_folder: the folder of converted sectors within a project, see readers/cache.py
+        """
+        self.path = path
+        self.cache_folder = cache_folder
+        self.connection = sqlite3.connect(str(path))
+        self.connection.row_factory = sqlite3.Row
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.executescript('DROP TABLE IF EXISTS projects; DROP TABLE IF EXISTS layouts; DROP TABLE IF EXISTS sectors;')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self) -> 'Catalog':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        entry = dict(row)
+        for key in JSON_COLUMNS:
+            if entry.get(key) is not None:
+                entry[key] = json.loads(entry[key])
+        return entry
+
+    def _unchanged(self, table: str, path: Path, stat) -> bool:
+        row = self.connection.execute(f'SELECT size, mtime FROM {table} WHERE path = ?', (str(path),)).fetchone()
+        return row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime
+
+    def scan(self, root: Path) -> Dict[str, int]:
+        """
+        Indexes all projects below root, only files that changed since the last scan are parsed. Returns what was done.
+        Every project is committed on its own, files that can not be parsed are counted in errors and skipped.
+        """
+        counts = {'projects': 0, 'parsed': 0, 'layouts': 0, 'headers': 0, 'errors': 0, 'removed': 0}
+        found = set()
+        for project_file in sorted(root.rglob('*.ws')):
+            found.add(str(project_file))
+            counts['projects'] += 1
+            with self.connection:
+                try:
+                    counts['parsed'] += self._scan_project(project_file)
+                except PARSE_ERRORS as error:
+                    print(f'Skipping {project_file}: {error!r}')
+                    self._remove(str(project_file))
+                    counts['errors'] += 1
+                    continue
+                counts['layouts'] += self._scan_layouts(project_file, counts)
+                counts['headers'] += self._scan_sectors(project_file, counts)
+        with self.connection:
+            # projects below root that are gone
+            for (path,) in self.connection.execute('SELECT path FROM projects').fetchall():
+                if path not in found and Path(path).is_relative_to(root):
+                    self._remove(path)
+                    counts['removed'] += 1
+        return counts
+
+    def _remove(self, project: str) -> None:
+        self.connection.execute('DELETE FROM projects WHERE path = ?', (project,))
+        self.connection.execute('DELETE FROM layouts WHERE project = ?', (project,))
+        self.connection.execute('DELETE FROM sectors WHERE project = ?', (project,))
+
+    def _scan_project(self, project_file: Path) -> int:
+        stat = project_file.stat()
+        if self._unchanged('projects', project_file, stat):
+            return 0
+        parameters = read_project_parameters(project_file)
+        sectors = _as_list(parameters.get('Sector'))
+        name = project_file.stem
+        if '_AD_True' in name or '_AD_False' in name:
+            actuator_disk: Optional[int] = int('_AD_True' in name)
+        else:
+            actuator_disk = int(_as_list(parameters.get('RefinementType'))[:1] == ['3'])
+        cores = _float(parameters.get('ParallelCores'))
+        self.connection.execute('INSERT OR REPLACE INTO projects VALUES (?,?,?,?,?,?,?,?,?,?,?)', (
+            str(project_file), name, str(project_file.parent), stat.st_size, stat.st_mtime, json.dumps(sectors), len(sectors),
+            int(cores) if cores else 1, _float(parameters.get('VelocityBoundaryLayer')), actuator_disk, json.dumps(parameters)))
+        return 1
+
+    def _scan_layouts(self, project_file: Path, counts: Dict[str, int]) -> int:
+        parsed, found = 0, set()
+        for layout in sorted(project_file.parent.glob('*.lws')):
+            found.add(str(layout))
+            stat = layout.stat()
+            if self._unchanged('layouts', layout, stat):
+                continue
+            try:
+                root = ET.parse(layout).getroot()
+            except PARSE_ERRORS as error:
+                print(f'Skipping {layout}: {error!r}')
+                found.discard(str(layout))
+                counts['errors'] += 1
+                continue
+            heights = [element.text for element in root.iter() if _local(element.tag) == 'WindResourcesHeight']
+            climatologies = [element.text for element in root.iter() if _local(element.tag) == 'WecsClimFileName']
+            self.connection.execute('INSERT OR REPLACE INTO layouts VALUES (?,?,?,?,?,?,?)', (
+                str(layout), str(project_file), layout.stem, stat.st_size, stat.st_mtime, json.dumps(heights), json.dumps(climatologies)))
+            parsed += 1
+        for (path,) in self.connection.execute('SELECT path FROM layouts WHERE project = ?', (str(project_file),)).fetchall():
+            if path not in found:
+                self.connection.execute('DELETE FROM layouts WHERE path = ?', (path,))
+        return parsed
+
+    def _scan_sectors(self, project_file: Path, counts: Dict[str, int]) -> int:
+        """
+        The solved sectors in the windfield folder, the phi header is read again when the phi file changed.
+        A phi file that can not be read is kept with the error, so it is not read again until it changes.
+        """
+        windfield = project_file.parent / 'windfield'
+        cache = SectorCache(project_file.parent / self.cache_folder)
+        headers, found = 0, set()
+        for phi_path in sorted(windfield.glob('*.phi')):
+            sector = phi_path.stem
+            found.add(sector)
+            xyz_path = phi_path.with_suffix('.xyz')
+            phi_stat = phi_path.stat()
+            xyz_stat = xyz_path.stat() if xyz_path.is_file() else None
+            row = self.connection.execute('SELECT phi_size, phi_mtime, nx, ny, nz, fields, complete, error FROM sectors WHERE project = ? AND sector = ?', (str(project_file), sector)).fetchone()
+            if row is not None and row[0] == phi_stat.st_size and row[1] == phi_stat.st_mtime:
+                nx, ny, nz, fields, complete, error = row[2], row[3], row[4], row[5], row[6], row[7]
+            else:
+                try:
+                    header = read_phi_header(phi_path)
+                    nx, ny, nz, fields, complete, error = header['nx'], header['ny'], header['nz'], json.dumps(header['fields']), int(header['complete']), None
+                except PARSE_ERRORS as exception:
+                    print(f'Can not read the header of {phi_path}: {exception!r}')
+                    nx, ny, nz, fields, complete, error = None, None, None, None, 0, repr(exception)
+                    counts['errors'] += 1
+                headers += 1
+            cached = cache.phi_path(sector).is_file()
+            self.connection.execute('INSERT OR REPLACE INTO sectors VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', (
+                str(project_file), sector, str(phi_path), phi_stat.st_size, phi_stat.st_mtime,
+                str(xyz_path) if xyz_stat else None, xyz_stat.st_size if xyz_stat else None, xyz_stat.st_mtime if xyz_stat else None,
+                nx, ny, nz, fields, complete, error, str(cache.folder), int(cached), int(cached and cache.is_fresh(sector, windfield)), cache.grid_hash(sector)))
+        for (sector,) in self.connection.execute('SELECT sector FROM sectors WHERE project = ?', (str(project_file),)).fetchall():
+            if sector not in found:
+                self.connection.execute('DELETE FROM sectors WHERE project = ? AND sector = ?', (str(project_file), sector))
+        return headers
+
+    def project(self, project_file: Path) -> Optional[Dict[str, Any]]:
+        """ The entry of one project, parsed again if the .ws file changed, i.e. for the runners """
+        if project_file.is_file():
+            with self.connection:
+                self._scan_project(project_file)
+        return self._row(self.connection.execute('SELECT * FROM projects WHERE path = ?', (str(project_file),)).fetchone())
+
+    def projects(self, windspeed: Optional[float]=None, actuator_disk: Optional[bool]=None, solved: Optional[bool]=None, name: Optional[str]=None) -> List[Dict[str, Any]]:
+        """
+        The projects matching all the given conditions, with the number of solved sectors in n_solved.
+        solved: every sector of the project file has a complete .phi file, name: a pattern for LIKE, i.e. '%_AD_True_%'
+        Only the complete .phi files of the sectors in the project file count, not i.e. a renamed 072_red.phi or a
+        file the solver is still writing.
+        """
+        conditions, values = [], []
+        if windspeed is not None:
+            conditions.append('windspeed = ?')
+            values.append(float(windspeed))
+        if actuator_disk is not None:
+            conditions.append('actuator_disk = ?')
+            values.append(int(actuator_disk))
+        if name is not None:
+            conditions.append('name LIKE ?')
+            values.append(name)
+        query = 'SELECT * FROM projects' + (' WHERE ' + ' AND '.join(conditions) if conditions else '') + ' ORDER BY path'
+        solved_sectors: Dict[str, set] = {}
+        for project, sector in self.connection.execute('SELECT project, sector FROM sectors WHERE complete = 1'):
+            solved_sectors.setdefault(project, set()).add(_sector_key(sector))
+        entries = []
+        for row in self.connection.execute(query, values):
+            entry = self._row(row)
+            configured = {_sector_key(sector) for sector in entry['sectors']}
+            entry['n_solved'] = len(configured & solved_sectors.get(entry['path'], set()))
+            if solved is None or (entry['n_solved'] >= len(configured)) == solved:
+                entries.append(entry)
+        return entries
+
+    def layouts(self, project_file: Path) -> List[Dict[str, Any]]:
+        return [self._row(row) for row in self.connection.execute('SELECT * FROM layouts WHERE project = ? ORDER BY name', (str(project_file),))]
+
+    def sectors(self, project_file: Path) -> List[Dict[str, Any]]:
+        return [self._row(row) for row in self.connection.execute('SELECT * FROM sectors WHERE project = ? ORDER BY sector', (str(project_file),))]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/dataset.py
+
+"""
+A converted sector, the grid as saved by Grid.save together with the fields as saved by Phi.save.
+Sectors converted through the grid store share the grid arrays, and know the hash of their grid.
+"""
+from pathlib import Path
+from typing import Mapping, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .fields import FieldRegistry
+
+
+class Dataset:
+    def __init__(self, name: str, grid: Mapping[str, NDArray[np.float64]], fields: FieldRegistry, grid_hash: Optional[str]=None):
+        self.name = name
+        self.grid = grid
+        self.fields = fields
+        self.grid_hash = grid_hash
+
+    @classmethod
+    def load(cls, name: str, grid_path: Path, phi_path: Path) -> 'Dataset':
+        return cls(name, np.load(grid_path), FieldRegistry.from_npz(np.load(phi_path)))
+
+    @property
+    def coord_centered(self) -> NDArray[np.float64]:
+        return self.grid['coord_centered']
+
+    @property
+    def coord_vertices(self) -> NDArray[np.float64]:
+        return self.grid['coord_vertices']
+
+    @property
+    def coord_ground(self) -> NDArray[np.float64]:
+        return self.grid['coord_ground']
+
+    def __getitem__(self, name: str) -> NDArray[np.float64]:
+        return self.fields[name]
+
+    def __repr__(self) -> str:
+        return f'Dataset({self.name!r}, shape={self.fields.shape}, fields={self.fields.stored})'
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/fields.py
+
+"""
+Registry of the fields in a phi file, with dictionary lookup of the stored fields and derived
+quantities computed on demand.
+
+The stored fields keep the phoenics names, which are 4 characters long ('UCRT', 'KE  ', 'P1  ').
+Shorter names are padded, so fields['KE'] is the same as fields['KE  '].
+Derived fields have lower case names and are memoized, bounded by max_bytes:
+    speed       horizontal speed from UCRT and VCRT
+    speed3d     speed from UCRT, VCRT and WCRT
+    ti          turbulence intensity, sqrt(2/3 KE) / speed
+    inflow      inflow angle in degrees, positive upwards
+    direction   meteorological wind direction in degrees, the direction the wind is coming from
+    speedup     speed relative to the speed at the reference point, see set_reference
+
+All fields have the phi layout (z,x,y).
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .lru import LRUCache
+
+
+class FieldNotFoundError(KeyError):
+    pass
+
+
+def _speed(fields: 'FieldRegistry') -> NDArray[np.float64]:
+    return np.hypot(fields['UCRT'], fields['VCRT'])
+
+def _speed3d(fields: 'FieldRegistry') -> NDArray[np.float64]:
+    return np.sqrt(fields['speed']**2 + fields['WCRT']**2)
+
+def _turbulence_intensity(fields: 'FieldRegistry') -> NDArray[np.float64]:
+    speed = fields['speed']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(speed > 0, np.sqrt(2/3*np.clip(fields['KE  '], 0, None))/speed, np.nan)
+
+def _inflow(fields: 'FieldRegistry') -> NDArray[np.float64]:
+    return np.degrees(np.arctan2(fields['WCRT'], fields['speed']))
+
+def _direction(fields: 'FieldRegistry') -> NDArray[np.float64]:
+    # UCRT points east and VCRT north, the wind comes from the opposite direction
+    return np.mod(270 - np.degrees(np.arctan2(fields['VCRT'], fields['UCRT'])), 360)
+
+def _speedup(fields: 'FieldRegistry') -> NDArray[np.float64]:
+    if fields.reference is None:
+        raise ValueError('speedup needs a reference point, use set_reference((iz, ix, iy)) first.')
+    speed = fields['speed']
+    return speed / speed[fields.reference]
+
+
+DERIVED: Dict[str, Tuple[Callable[['FieldRegistry'], NDArray[np.float64]], Tuple[str, ...]]] = {
+    'speed': (_speed, ('UCRT', 'VCRT')),
+    'speed3d': (_speed3d, ('UCRT', 'VCRT', 'WCRT')),
+    'ti': (_turbulence_intensity, ('UCRT', 'VCRT', 'KE  ')),
+    'inflow': (_inflow, ('UCRT', 'VCRT', 'WCRT')),
+    'direction': (_direction, ('UCRT', 'VCRT')),
+    'speedup': (_speedup, ('UCRT', 'VCRT')),
+}
+
+
+class FieldRegistry:
+    def __init__(self, names: Iterable[str], data: NDArray[np.float64], max_bytes: int=512*1024**2):
+        """
+        names: the stored field names in the same order as the first axis of data
+        data: the fields with shape (field,z,x,y), as in Phi.phi or the 'data' of a saved phi file
+        max_bytes: the memory the memoized derived fields may use before the least recently used are evicted
+        """
+        self.names: List[str] = [str(name) for name in names]
+        self.data = data
+        self._index: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self._derived = LRUCache(max_bytes=max_bytes)
+        self.reference: Optional[Tuple[int, int, int]] = None
+
+    @classmethod
+    def from_npz(cls, fields, max_bytes: int=512*1024**2) -> 'FieldRegistry':
+        """ From a loaded phi file, saved with Phi.save """
+        return cls(names=fields['headers'], data=fields['data'], max_bytes=max_bytes)
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        if not isinstance(name, str):
+            raise TypeError(f'Field names are strings, got {type(name).__name__}')
+        if name in DERIVED:
+            return name
+        if len(name) > 4:
+            raise FieldNotFoundError(f'{name!r} is not a field, stored field names have 4 characters.')
+        return name.ljust(4)
+
+    @property
+    def stored(self) -> List[str]:
+        return list(self.names)
+
+    @property
+    def derived(self) -> List[str]:
+        """ The derived fields that can be computed from the stored fields """
+        return [name for name, (_, requires) in DERIVED.items() if all(r in self._index for r in requires)]
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(self.data.shape[1:])
+
+    def __contains__(self, name: str) -> bool:
+        try:
+            name = self.normalize(name)
+        except (KeyError, TypeError):
+            return False
+        return name in self._index or name in self.derived
+
+    def __getitem__(self, name: str) -> NDArray[np.float64]:
+        name = self.normalize(name)
+        if name in self._index:
+            return self.data[self._index[name]]
+        if name not in DERIVED:
+            raise FieldNotFoundError(f'{name!r} is not a field, possible fields are: {self.stored + self.derived}')
+
+        field = self._derived.get(name)
+        if field is None:
+            compute, requires = DERIVED[name]
+            missing = [r for r in requires if r not in self._index]
+            if missing:
+                raise FieldNotFoundError(f'{name!r} needs the fields {missing}, which are not stored in this phi file.')
+            field = compute(self)
+            self._derived[name] = field
+        return field
+
+    def set_reference(self, index: Optional[Tuple[int, int, int]]) -> None:
+        """ The (iz, ix, iy) cell the speedup is relative to """
+        self.reference = None if index is None else tuple(int(i) for i in index)
+        self._derived.pop('speedup')
+
+    def clear(self) -> None:
+        """ Drop the memoized derived fields """
+        self._derived.clear()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/grid_store.py
+
+"""
+Content addressed store of converted grids.
+
+The sectors of a project, and the variants made from a base project (windspeeds, AD_False projects),
+mostly share the same .xyz grid. The store keys a converted grid by the hash of the .xyz file, so
+the parsing and the cell center computation is done once per unique grid and the sectors only keep a
+reference to it:
+    <store>/<hash>.xyz.npz    the grid, see Grid.save
+    <store>/<hash>.lock       while a process converts the grid, the others wait for it instead of parsing it as well.
+                              The converting process touches it every stale_after/4 seconds, a lock that is not
+                              touched for stale_after seconds was left by a killed process and is taken over.
+"""
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .xyz_reader import Grid
+
+
+def hash_file(path: Path, block_size: int=2**20) -> str:
+    """ sha256 of the content of the file """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for block in iter(lambda: infile.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class GridStore:
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self._loaded: Dict[str, Dict[str, NDArray[np.float64]]] = {}
+        self._lock = threading.Lock()
+
+    def path(self, grid_hash: str) -> Path:
+        return self.folder / f'{grid_hash}.xyz.npz'
+
+    def __contains__(self, grid_hash: str) -> bool:
+        return self.path(grid_hash).is_file()
+
+    def lock_path(self, grid_hash: str) -> Path:
+        return self.folder / f'{grid_hash}.lock'
+
+    def _claim(self, grid_hash: str, stale_after: float) -> bool:
+        """ Takes the lock of the hash, False if another process holds it. Locks older than stale_after are left by a killed process and taken over """
+        lock = self.lock_path(grid_hash)
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - lock.stat().st_mtime > stale_after:
+                    # renamed first, so of several waiters only one removes it, and not a lock made again meanwhile
+                    taken = lock.with_name(f'{lock.name}.{os.getpid()}.{threading.get_ident()}.stale')
+                    os.replace(lock, taken)
+                    if time.time() - taken.stat().st_mtime > stale_after:
+                        taken.unlink()
+                    else:
+                        os.replace(taken, lock)
+            except FileNotFoundError:
+                pass
+            return False
+
+    @staticmethod
+    def _keep_alive(lock: Path, interval: float, stop: threading.Event) -> None:
+        """ Touches the lock every interval seconds until stop is set, so a long conversion is not taken for a killed one """
+        while not stop.wait(interval):
+            try:
+                os.utime(lock)
+            except FileNotFoundError:
+                pass
+
+    def add(self, xyz: Path, poll_interval: float=0.5, stale_after: float=3600) -> str:
+        """
+        Converts the .xyz file unless a grid with the same content is in the store already, returns the hash.
+        When another process is converting the same grid, waits for it, so every grid is parsed once.
+        stale_after: seconds after which a lock that is not touched any more is taken over
+        """
+        grid_hash = hash_file(xyz)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        waited = False
+        while grid_hash not in self:
+            if not self._claim(grid_hash, stale_after):
+                if not waited:
+                    print(f'Grid {xyz} is being converted by another process as {grid_hash[:12]}, waiting for it')
+                    waited = True
+                time.sleep(poll_interval)
+                continue
+            stop = threading.Event()
+            keep_alive = threading.Thread(target=self._keep_alive, args=(self.lock_path(grid_hash), stale_after/4, stop), daemon=True)
+            keep_alive.start()
+            try:
+                # another process may have finished between the check and the claim
+                if grid_hash in self:
+                    break
+                grid = Grid()
+                grid.read(xyz)
+                grid.computeCellCenterCoord()
+                # Written under a temporary name first and renamed, so the others never see a partial file
+                temporary = self.folder / f'{grid_hash}.{os.getpid()}.{threading.get_ident()}.tmp.npz'
+                grid.save(path=temporary)
+                os.replace(temporary, self.path(grid_hash))
+                # the arrays just converted are kept, so the sector being converted does not read them back
+                with self._lock:
+                    self._loaded[grid_hash] = {'coord_centered': grid.coord_phiCC, 'coord_vertices': grid.coord_phi,
+                                               'coord_ground': grid.groundLevelCC, 'headers': np.array(['x', 'y', 'z'])}
+                return grid_hash
+            finally:
+                stop.set()
+                keep_alive.join()
+                self.lock_path(grid_hash).unlink(missing_ok=True)
+        print(f'Grid {xyz} is already converted as {grid_hash[:12]}')
+        return grid_hash
+
+    def load(self, grid_hash: str) -> Dict[str, NDArray[np.float64]]:
+        """ The grid arrays, loaded once per process and shared by all datasets referencing the grid """
+        with self._lock:
+            if grid_hash not in self._loaded:
+                with np.load(self.path(grid_hash)) as grid:
+                    self._loaded[grid_hash] = {key: grid[key] for key in grid.files}
+            return self._loaded[grid_hash]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/lru.py
+
+"""
+Small least-recently-used cache, bounded by the number of entries and/or by the total size of the entries.
+Used for memoized derived fields and cached slices.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+def _nbytes(value: Any) -> int:
+    return int(getattr(value, 'nbytes', 0))
+
+
+class LRUCache:
+    def __init__(self, maxsize: Optional[int]=None, max_bytes: Optional[int]=None, sizeof: Callable[[Any], int]=_nbytes):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __getitem__(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self._entries[key]
+            self._entries.move_to_end(key)
+            return value
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            self._evict()
+
+    def _remove(self, key: Hashable) -> None:
+        del self._entries[key]
+        self.nbytes -= self._sizes.pop(key)
+
+    def _evict(self) -> None:
+        # The newest entry is always kept, even if it alone is larger than max_bytes
+        while len(self._entries) > 1:
+            too_many = self.maxsize is not None and len(self._entries) > self.maxsize
+            too_large = self.max_bytes is not None and self.nbytes > self.max_bytes
+            if not (too_many or too_large):
+                break
+            self._remove(next(iter(self._entries)))
+
+    def pop(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value = self._entries[key]
+            self._remove(key)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.nbytes = 0
@@ -11,13 +11,67 @@ Modified on September 2023
 
 import numpy as np
 import fortranformat as ff
-import matplotlib.pyplot as plt
 import py7zr
 
 
+import mmap
 import sys
 
+from concurrent.futures import ProcessPoolExecutor
+from numpy.typing import NDArray
 from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .archive import Archive, save_archive
+from .fields import FieldRegistry
+from .shared import create_array, open_array, take_array
+
+
+def slab_layout(mm: mmap.mmap, offset: int, n: int, n_slabs: int) -> Optional[int]:
+    """ The size in bytes of a slab of n values, written 6 per line, if all n_slabs slabs after offset have that size """
+    end = offset
+    for _ in range((n + 5)//6):
+        end = mm.find(b'\n', end) + 1
+        if end == 0:
+            return None
+    slab_bytes = end - offset
+    # the line ends of the first slab repeat at the end of every slab
+    last = offset + n_slabs*slab_bytes
+    if last > len(mm) or any(mm[offset + i*slab_bytes - 1:offset + i*slab_bytes] != b'\n' for i in range(1, n_slabs + 1)):
+        return None
+    return slab_bytes
+
+
+def decode_slab(slab: bytes, n: int) -> NDArray[np.float64]:
+    """ The n values of a slab, 6 fixed width values of 13 characters per line """
+    lines = slab.splitlines()
+    full = n//6
+    try:
+        if full and all(len(line) == 78 for line in lines[:full]):
+            values = np.empty(n)
+            values[:6*full] = np.frombuffer(b''.join(lines[:full]), dtype='S13').astype(np.float64)
+            if n % 6:
+                values[6*full:] = np.frombuffer(lines[full][:13*(n % 6)], dtype='S13').astype(np.float64)
+            return values
+    except ValueError:
+        pass
+    # i.e. exponents of three digits without the E, as written by fortran
+    reader = ff.FortranRecordReader('(6(1PE13.6))')
+    values = np.array([value for line in lines for value in reader.read(line.decode())])
+    return values[:n]
+
+
+def decode_slabs(path: str, spec: Dict[str, Any], offset: int, slab_bytes: int, first: int, last: int, n: int) -> None:
+    """ Decodes the slabs first to last of the file into the shared array, runs in a worker process """
+    block, phi = open_array(spec)
+    nfields, nz, nx, ny = phi.shape
+    with open(path, 'rb') as binaryFile, mmap.mmap(binaryFile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for slab in range(first, last):
+            iz, iphi = divmod(slab, nfields)
+            start = offset + slab*slab_bytes
+            phi[iphi, iz] = decode_slab(mm[start:start + slab_bytes], n).reshape(nx, ny)
+    del phi
+    block.close()
 
 
 class Phi:
@@ -40,6 +94,7 @@ class Phi:
         self.FieldNames=[]
         self.NumStoredFields=0
         self.phi=np.array([])
+        self._fields: Optional[FieldRegistry]=None
         
         #store thw specified file
         self.file=""
@@ -49,18 +104,20 @@ class Phi:
         #print(self.phi.shape)
         return self.phi[0].shape
         
+    @property
+    def fields(self) -> FieldRegistry:
+        #the registry is made again when a new file has been read
+        if self._fields is None or self._fields.data is not self.phi:
+            self._fields = FieldRegistry(self.FieldNames, self.phi)
+        return self._fields
+
     def getField(self,field):
-        if(len(field)!=4):
-            sys.exit('field variable needs to have 4 characters in length.')
-        ifield=0
-        for i in range(self.NumStoredFields):
-            if self.FieldNames[i]==field:
-                ifield=i
-        #print(self.FieldNames[ifield], "is returned!!")
-        return self.phi[ifield]             
+        #stored fields like 'UCRT' or 'KE  ', or derived fields like 'speed', see readers/fields.py
+        return self.fields[field]
 
         
-    def read(self,fileIN: Path):
+    def read(self,fileIN: Path, workers: int=1):
+        #workers > 1 decodes the slabs of the fields in that many processes, see readFieldsParallel
         
         self.file=fileIN
         if not fileIN.is_file():
@@ -72,6 +129,17 @@ class Phi:
         
         print("**********************READING ",fileIN,"**********************")
 
+        offset = self.readHeader(phiFile)
+        if workers > 1 and self.readFieldsParallel(fileIN, offset, workers):
+            phiFile.close()
+            return
+        self.readFields(phiFile)
+        phiFile.close()
+
+    def readHeader(self, phiFile, verbose: bool=True) -> int:
+        #reads everything before the fields, returns the byte offset of the first field slab in the file
+        #on its own it gives the sizes and field names without reading the fields, i.e. for the catalog
+
         #THE HEADER
         #line 1:;
         #phoenics title and version
@@ -226,14 +294,17 @@ class Phi:
                 self.NumStoredFields+=1
                 self.FieldNames.append(names[i])
                 
-        print("---------------------------------------------------------------------------------")
-        print("---------------------------CONTAINED VARIABLES-----------------------------------")
-        print("---------------------------------------------------------------------------------")
-        print(self.NumStoredFields, " stored variables are found: ",self.FieldNames)
-        print("---------------------------------------------------------------------------------")
-        print("---------------------------------------------------------------------------------")    
-    
-          
+        if verbose:
+            print("---------------------------------------------------------------------------------")
+            print("---------------------------CONTAINED VARIABLES-----------------------------------")
+            print("---------------------------------------------------------------------------------")
+            print(self.NumStoredFields, " stored variables are found: ",self.FieldNames)
+            print("---------------------------------------------------------------------------------")
+            print("---------------------------------------------------------------------------------")    
+
+        return phiFile.tell()
+
+    def readFields(self, phiFile):
         #THE FIELDS  
         #fortran format: Ew.d with E specifying scientific notation, w is the total width including exponent and d specifies the number of decimal places
         #fortran format: 1P shifts the decimal point by one place for example 0.123E+03 is shown as 1.230E+02 when 1P is active
@@ -259,7 +330,35 @@ class Phi:
                     for iy in range(self.ny):   
                             self.phi[iphi,iz,ix,iy]=slab[iy+ix*(self.ny)]
                             
+    def readFieldsParallel(self, fileIN: Path, offset: int, workers: int) -> bool:
+        #every (iz, field) slab has the same number of lines, so the byte range of each slab follows from the first one
+        #the slabs are decoded in worker processes directly into a shared array, False if the layout is not as expected
+        n_slabs = self.nz*self.NumStoredFields
+        with open(fileIN, 'rb') as binaryFile, mmap.mmap(binaryFile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            slab_bytes = slab_layout(mm, offset, self.nx*self.ny, n_slabs)
+        if slab_bytes is None:
+            print("The slabs do not have the same size, reading the fields serially")
+            return False
+
+        block, spec = create_array((self.NumStoredFields, self.nz, self.nx, self.ny))
+        try:
+            # a few ranges per worker, so a slow worker does not hold up the others
+            bounds = np.linspace(0, n_slabs, min(n_slabs, 4*workers) + 1).astype(int)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(decode_slabs, str(fileIN), spec, offset, slab_bytes, first, last, self.nx*self.ny)
+                           for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+                for future in futures:
+                    future.result()
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+        self.phi = take_array(block, spec)
+        return True
+
     def plotVerticalProfile(self,grid,X=0,Y=0,field="P1  ",fig=None,index=111):
+        #imported here, so reading and converting files does not need matplotlib
+        import matplotlib.pyplot as plt
         if fig is None:
             fig=plt.figure()
        
@@ -296,6 +395,14 @@ class Phi:
 
         return np.load(path)
 
+    def save_archive(self, path: Path, codec: str='zlib', level: int=6, workers: Optional[int]=None):
+        #chunked archive compressed on several threads, see readers/archive.py
+        save_archive(path, {'data': self.phi}, attrs={'headers': list(self.FieldNames)}, codec=codec, level=level, workers=workers)
+
+    def load_archive(self, path: Path) -> Archive:
+        #gives 'data' and 'headers' like load, the data is read when it is asked for
+        return Archive(path)
+
 
 
 if __name__ == "__main__":
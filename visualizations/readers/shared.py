@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# readers/shared.py
+
+"""
+Sharing a converted sector with a pool of worker processes without copying it.
+
+SharedDataset copies the grid and the fields of a Dataset once into multiprocessing.shared_memory
+blocks. Its descriptor is a small dict of block names, shapes and dtypes that is cheap to pickle, and
+attach(descriptor) gives a Dataset in the worker whose arrays are read-only views of the blocks. N
+workers on one sector therefore use the memory of one copy instead of N.
+
+The blocks are reference counted in the publishing process: submit acquires a reference for every task
+and releases it when the future is done, and the blocks are unlinked once the dataset is closed and the
+last task has finished.
+
+    with SharedDataset(cache.load('000')) as shared, ProcessPoolExecutor(4) as pool:
+        futures = [shared.submit(pool, sample, points) for points in chunks]
+    # in the worker
+    def sample(descriptor, points):
+        dataset = attach(descriptor)
+
+The workers must be started by the publishing process, so they share its resource tracker.
+"""
+import threading
+import uuid
+from concurrent.futures import Executor, Future
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, Tuple
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .dataset import Dataset
+from .fields import FieldRegistry
+
+# Datasets attached in this process, by the token of the descriptor
+_attached: Dict[str, Dataset] = {}
+_lock = threading.Lock()
+
+
+def _open_block(name: str) -> shared_memory.SharedMemory:
+    try:
+        # Python 3.13 and later, the publishing process owns the block
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore[call-arg]
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _view(block: shared_memory.SharedMemory, shape: Tuple[int, ...], dtype: str) -> NDArray:
+    array: NDArray = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    return array
+
+
+def create_array(shape: Tuple[int, ...], dtype: str='<f8') -> Tuple[shared_memory.SharedMemory, Dict[str, Any]]:
+    """ A new block for an array, and its spec for open_array in the workers """
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    return block, {'block': block.name, 'shape': list(shape), 'dtype': np.dtype(dtype).str}
+
+
+def open_array(spec: Dict[str, Any]) -> Tuple[shared_memory.SharedMemory, NDArray]:
+    """ The block of the spec and a writable view of it, the view must be deleted before closing the block """
+    block = _open_block(spec['block'])
+    return block, _view(block, tuple(spec['shape']), spec['dtype'])
+
+
+class _BlockOwner:
+    """
+    Base of the arrays of take_array and attach, keeps the block open as long as the array or a view of it is used.
+    numpy does not hold on to the buffer of the block, closing the block under a view would unmap its memory.
+    """
+    def __init__(self, block: shared_memory.SharedMemory, spec: Dict[str, Any]):
+        self.block = block
+        self.view = _view(block, tuple(spec['shape']), spec['dtype'])
+        self.__array_interface__ = self.view.__array_interface__
+
+    def __del__(self):
+        # the view holds an export of the buffer of the block, it goes first
+        del self.view
+        self.block.close()
+
+
+def take_array(block: shared_memory.SharedMemory, spec: Dict[str, Any]) -> NDArray:
+    """
+    The array of a block made by create_array as a plain numpy array in this process. The name is unlinked and the
+    block is closed with the last view of the array, without copying the array.
+    """
+    block.unlink()
+    return np.asarray(_BlockOwner(block, spec))
+
+
+class SharedDataset:
+    def __init__(self, dataset: Dataset):
+        """ Copies the grid and the fields of the dataset into shared memory blocks """
+        self.name = dataset.name
+        self.token = uuid.uuid4().hex
+        self._blocks: Dict[str, shared_memory.SharedMemory] = {}
+        self._count = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+        arrays = {key: np.asarray(dataset.grid[key]) for key in ('coord_centered', 'coord_vertices', 'coord_ground')}
+        arrays['data'] = np.asarray(dataset.fields.data)
+        self.descriptor: Dict[str, Any] = {'token': self.token, 'name': dataset.name, 'grid_hash': dataset.grid_hash, 'headers': dataset.fields.stored, 'arrays': {}}
+        try:
+            for key, array in arrays.items():
+                block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._blocks[key] = block
+                _view(block, array.shape, array.dtype.str)[...] = array
+                self.descriptor['arrays'][key] = {'block': block.name, 'shape': list(array.shape), 'dtype': array.dtype.str}
+        except Exception:
+            self._unlink()
+            raise
+
+    @property
+    def nbytes(self) -> int:
+        return sum(block.size for block in self._blocks.values())
+
+    def __enter__(self) -> 'SharedDataset':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def acquire(self) -> Dict[str, Any]:
+        """ Takes a reference for a task, returns the descriptor to give to it """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f'The shared dataset {self.name} is closed.')
+            self._count += 1
+        return self.descriptor
+
+    def release(self, *args) -> None:
+        """ Gives back the reference of a task, fits Future.add_done_callback """
+        with self._lock:
+            self._count -= 1
+            unlink = self._closed and self._count == 0
+        if unlink:
+            self._unlink()
+
+    def submit(self, executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+        """ executor.submit(fn, descriptor, *args, **kwargs), holding a reference until the task is done """
+        descriptor = self.acquire()
+        try:
+            future = executor.submit(fn, descriptor, *args, **kwargs)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(self.release)
+        return future
+
+    def close(self) -> None:
+        """ No new tasks, the blocks are unlinked now or when the last running task is done """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            unlink = self._count == 0
+        if unlink:
+            self._unlink()
+
+    def _unlink(self) -> None:
+        for block in self._blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # Views are still used in this process, the memory is freed when they are gone
+                pass
+            block.unlink()
+        self._blocks = {}
+
+
+def attach(descriptor: Dict[str, Any]) -> Dataset:
+    """ The shared dataset as read-only views of the blocks, attached once per process """
+    with _lock:
+        if descriptor['token'] not in _attached:
+            _detach_unused()
+            arrays = {}
+            for key, spec in descriptor['arrays'].items():
+                arrays[key] = np.asarray(_BlockOwner(_open_block(spec['block']), spec))
+                arrays[key].flags.writeable = False
+            fields = FieldRegistry(descriptor['headers'], arrays.pop('data'))
+            _attached[descriptor['token']] = Dataset(descriptor['name'], arrays, fields, grid_hash=descriptor['grid_hash'])
+        return _attached[descriptor['token']]
+
+
+def detach(descriptor: Dict[str, Any]) -> None:
+    """ Forgets the dataset of the descriptor in this process, its blocks are closed with the last view of them """
+    with _lock:
+        _attached.pop(descriptor['token'], None)
+
+
+def _detach_unused() -> None:
+    # Tasks of a new dataset arrive, the earlier datasets are dropped, their blocks stay open while views of them are used
+    _attached.clear()
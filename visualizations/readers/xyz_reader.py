@@ -17,7 +17,9 @@ import py7zr
 from pathlib import Path
 
 from numpy.typing import NDArray
-from typing import Any, TextIO, Dict
+from typing import Any, TextIO, Dict, Optional
+
+from .archive import Archive, save_archive
 
 class Grid:
     def __init__(self):
@@ -145,6 +147,20 @@ class Grid:
 
         return grid
 
+    def save_archive(self, path: Path, codec: str='zlib', level: int=6, workers: Optional[int]=None) -> None:
+        #chunked archive compressed on several threads, see readers/archive.py
+        arrays = {'coord_centered': self.coord_phiCC, 'coord_vertices': self.coord_phi, 'coord_ground': self.groundLevelCC}
+        save_archive(path, arrays, attrs={'headers': ['x', 'y', 'z']}, codec=codec, level=level, workers=workers)
+
+    def load_archive(self, path: Path) -> Dict[str, NDArray[np.float64]]:
+        with Archive(path) as archive:
+            grid: Dict[str, NDArray[np.float64]] = {name: archive.read(name) for name in archive.index['arrays']}
+        self.coord_phiCC = grid['coord_centered']
+        self.coord_phi = grid['coord_vertices']
+        self.groundLevelCC = grid['coord_ground']
+
+        return grid
+
 
 
 
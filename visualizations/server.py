@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+
+"""
+Local HTTP service for slices of the converted sectors, for dashboards and other non-python clients.
+
+    python -m visualizations serve --cache "<project>/my_documentation" --port 8765
+
+GET /sectors                                                    json list of the converted sectors
+GET /sectors/<sector>                                           json metadata: shape, fields, coordinates of the columns
+GET /sectors/<sector>/<field>/horizontal?height=100             (x,y) at the height above ground
+GET /sectors/<sector>/<field>/vertical?x0=&y0=&x1=&y1=&n=100    (2,point,z): height above sea and field on the line from x0,y0 to x1,y1
+GET /sectors/<sector>/<field>/profile?x=&y=                     (2,z): height above ground and field in the column at x,y
+
+Fields are the stored and derived fields of readers/fields.py, 'KE' for 'KE  '. Arrays are sent as raw
+little-endian float32 in C order, the X-Shape and X-Dtype headers give their shape and dtype. The encoded
+responses are kept in a least recently used cache bounded in bytes, keyed by the sector, the field and
+the slice parameters, so repeated requests are served without touching the fields. The slices are
+computed in a thread pool, the asyncio server keeps answering other clients meanwhile.
+"""
+import asyncio
+import json
+import math
+import threading
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .analysis.heights import horizontal_axes
+from .analysis.sections import horizontal_slice, profile, vertical_section
+from .readers.cache import SectorCache
+from .readers.dataset import Dataset
+from .readers.fields import FieldNotFoundError
+from .readers.lru import LRUCache
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class Response:
+    def __init__(self, status: int, body: bytes, content_type: str='application/json', headers: Optional[Dict[str, str]]=None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, value: Any, status: int=200) -> 'Response':
+        return cls(status, json.dumps(value).encode())
+
+    @classmethod
+    def error(cls, status: int, message: str) -> 'Response':
+        return cls.json({'error': message}, status=status)
+
+    @classmethod
+    def array(cls, array: NDArray) -> 'Response':
+        array = np.ascontiguousarray(array, dtype='<f4')
+        return cls(200, array.tobytes(), 'application/octet-stream', {'X-Shape': ','.join(map(str, array.shape)), 'X-Dtype': array.dtype.str})
+
+    def encode(self, cache: str, keep_alive: bool) -> bytes:
+        lines = [f'HTTP/1.1 {self.status} {REASONS.get(self.status, "")}',
+                 f'Content-Type: {self.content_type}',
+                 f'Content-Length: {len(self.body)}',
+                 'Access-Control-Allow-Origin: *',
+                 'Access-Control-Expose-Headers: X-Shape, X-Dtype, X-Cache',
+                 f'X-Cache: {cache}',
+                 f'Connection: {"keep-alive" if keep_alive else "close"}']
+        lines.extend(f'{key}: {value}' for key, value in self.headers.items())
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + self.body
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _float(query: Dict[str, List[str]], name: str, default: Optional[float]=None) -> float:
+    if name not in query:
+        if default is None:
+            raise RequestError(400, f'The parameter {name} is missing.')
+        return default
+    try:
+        value = float(query[name][0])
+    except ValueError:
+        raise RequestError(400, f'The parameter {name} is not a number: {query[name][0]!r}')
+    if not math.isfinite(value):
+        raise RequestError(400, f'The parameter {name} is not a finite number: {query[name][0]!r}')
+    return value
+
+
+class SliceServer:
+    def __init__(self, cache: SectorCache, max_bytes: int=256*1024**2, max_datasets: int=4):
+        """
+        max_bytes: the size of the cached responses
+        max_datasets: the number of sectors kept loaded
+        """
+        self.cache = cache
+        self.responses = LRUCache(max_bytes=max_bytes, sizeof=lambda response: len(response.body))
+        self.datasets = LRUCache(maxsize=max_datasets)
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._load_lock = threading.Lock()
+        # the converted sectors, listed again when a request asks for one that is not known yet
+        self._sectors: Set[str] = set()
+        self.port: Optional[int] = None
+
+    def sectors(self) -> List[str]:
+        sectors = self.cache.sectors()
+        self._sectors = set(sectors)
+        return sectors
+
+    def check_sector(self, sector: str) -> str:
+        """ The sector if it is converted in the cache, names that could point outside of the cache are rejected before any file is touched """
+        if not sector or any(part in sector for part in ('/', '\\', '..')):
+            raise RequestError(404, f'The sector {sector} is not converted.')
+        if sector not in self._sectors and sector not in self.sectors():
+            raise RequestError(404, f'The sector {sector} is not converted.')
+        return sector
+
+    def dataset(self, sector: str) -> Dataset:
+        """ The loaded sector, the name is checked by route """
+        with self._load_lock:
+            dataset = self.datasets.get(sector)
+            if dataset is None:
+                try:
+                    dataset = self.cache.load(sector)
+                except FileNotFoundError:
+                    # removed from the cache since it was listed
+                    self._sectors.discard(sector)
+                    raise RequestError(404, f'The sector {sector} is not converted.')
+                self.datasets[sector] = dataset
+            return dataset
+
+    def metadata(self, sector: str) -> Dict[str, Any]:
+        dataset = self.dataset(sector)
+        x_centers, y_centers = horizontal_axes(dataset.coord_centered)
+        return {
+            'sector': sector,
+            'grid_hash': dataset.grid_hash,
+            'shape': dict(zip(('z', 'x', 'y'), dataset.fields.shape)),
+            'stored': [name.strip() for name in dataset.fields.stored],
+            'derived': dataset.fields.derived,
+            'x': x_centers.tolist(),
+            'y': y_centers.tolist(),
+            'elevation': [float(dataset.coord_ground.min()), float(dataset.coord_ground.max())],
+        }
+
+    def compute(self, sector: str, field: str, kind: str, query: Dict[str, List[str]]) -> Tuple[Hashable, Any]:
+        """ The cache key and a function computing the response of a slice request """
+        # 'KE' and 'KE  ' are the same field, see FieldRegistry.normalize
+        field = field.strip()
+        if kind == 'horizontal':
+            height = _float(query, 'height')
+            return (sector, field, kind, height), lambda: Response.array(horizontal_slice(self.dataset(sector), field, height))
+        if kind == 'vertical':
+            start, end = (_float(query, 'x0'), _float(query, 'y0')), (_float(query, 'x1'), _float(query, 'y1'))
+            n = int(_float(query, 'n', 100))
+            if not 1 <= n <= 10_000:
+                raise RequestError(400, 'n must be between 1 and 10000.')
+            return (sector, field, kind, start, end, n), lambda: Response.array(np.stack(vertical_section(self.dataset(sector), field, start, end, n)[::-1]))
+        if kind == 'profile':
+            x, y = _float(query, 'x'), _float(query, 'y')
+            return (sector, field, kind, x, y), lambda: Response.array(np.stack(profile(self.dataset(sector), field, x, y)[::-1]))
+        raise RequestError(404, f'Unknown slice {kind}, use horizontal, vertical or profile.')
+
+    def route(self, path: str, query: Dict[str, List[str]]) -> Tuple[Optional[Hashable], Any]:
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts == ['sectors']:
+            return None, lambda: Response.json(self.sectors())
+        if len(parts) in (2, 4) and parts[0] == 'sectors':
+            self.check_sector(parts[1])
+        if len(parts) == 2 and parts[0] == 'sectors':
+            return ('meta', parts[1]), lambda: Response.json(self.metadata(parts[1]))
+        if len(parts) == 4 and parts[0] == 'sectors':
+            return self.compute(parts[1], parts[2], parts[3], query)
+        raise RequestError(404, f'Unknown path {path}')
+
+    async def respond(self, method: str, target: str) -> Tuple[Response, str]:
+        """ The response to a request, and whether it came from the cache """
+        if method != 'GET':
+            return Response.error(405, 'Only GET is supported.'), 'none'
+        url = urlsplit(target)
+        try:
+            key, compute = self.route(url.path, parse_qs(url.query))
+            if key is not None:
+                cached = self.responses.get(key)
+                if cached is not None:
+                    return cached, 'hit'
+                # Requests for a slice that is being computed wait for it instead of computing it again
+                if key in self._pending:
+                    return await asyncio.shield(self._pending[key]), 'hit'
+            future = asyncio.get_running_loop().run_in_executor(None, compute)
+            if key is not None:
+                self._pending[key] = future
+            try:
+                response = await future
+            finally:
+                self._pending.pop(key, None)
+            if key is not None:
+                self.responses[key] = response
+            return response, 'miss'
+        except RequestError as error:
+            return Response.error(error.status, str(error)), 'none'
+        except FieldNotFoundError as error:
+            return Response.error(404, str(error.args[0])), 'none'
+        except ValueError as error:
+            return Response.error(400, str(error)), 'none'
+        except Exception as error:
+            print(f'Request {target} failed: {error!r}')
+            return Response.error(500, repr(error)), 'none'
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ One client connection, several requests when the connection is kept alive """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                method, target, version = request_line.decode('latin-1').split()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                response, cache = await self.respond(method, target)
+                writer.write(response.encode(cache, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str='127.0.0.1', port: int=8765, started: Optional[threading.Event]=None) -> None:
+        """ Serves until cancelled, port 0 takes a free port, which is in self.port once started is set """
+        server = await asyncio.start_server(self.handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        print(f'Serving {self.cache.folder} on http://{host}:{self.port}')
+        if started is not None:
+            started.set()
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# tests/conftest.py
+
+"""
+Small synthetic sectors for the tests, written directly as converted sectors (see readers/cache.py), so
+no WindSim project is needed. Run from the repository root with python -m pytest visualizations/tests.
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+FIELD_NAMES = ['P1  ', 'UCRT', 'VCRT', 'WCRT', 'KE  ', 'EP  ']
+
+
+def write_sector(folder: Path, sector: str, nx: int=8, ny: int=6, nz: int=5, seed: int=0) -> None:
+    """ <sector>.xyz.npz and <sector>.phi.npz of a terrain following grid over a smooth hill, in the cache layout without grid store """
+    folder.mkdir(parents=True, exist_ok=True)
+    x, y = np.linspace(0, 700, nx + 1), np.linspace(0, 500, ny + 1)
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    ground = 100 + 20*np.sin(X/300)*np.cos(Y/200)
+    s = np.linspace(0, 1, nz + 1)**1.5
+    vertices = np.empty((nx + 1, ny + 1, nz + 1, 3))
+    vertices[..., 0], vertices[..., 1] = X[..., None], Y[..., None]
+    vertices[..., 2] = ground[..., None] + (1000 - ground)[..., None]*s
+    corners = [vertices[i:i + nx, j:j + ny, k:k + nz] for i in (0, 1) for j in (0, 1) for k in (0, 1)]
+    centered = sum(corners)/8
+    ground_centered = sum(vertices[i:i + nx, j:j + ny, 0, 2] for i in (0, 1) for j in (0, 1))/4
+    np.savez_compressed(folder / f'{sector}.xyz.npz', coord_centered=centered, coord_vertices=vertices, coord_ground=ground_centered, headers=['x', 'y', 'z'])
+    fields = np.random.default_rng(seed).normal(5, 1, (len(FIELD_NAMES), nz, nx, ny))
+    fields[FIELD_NAMES.index('KE  ')] = np.abs(fields[FIELD_NAMES.index('KE  ')])
+    np.savez_compressed(folder / f'{sector}.phi.npz', data=fields, headers=FIELD_NAMES)
+
+
+def write_xyz(path: Path, nx: int=9, ny: int=7, nz: int=6) -> None:
+    """ A .xyz file of nx*ny*nz nodes, the x, y and z of every level 5 values per line """
+    x, y = np.meshgrid(np.linspace(0, 700, nx), np.linspace(0, 500, ny), indexing='ij')
+    ground = 100 + 20*np.sin(x/300)*np.cos(y/200)
+    with open(path, 'w') as xyz:
+        xyz.write(f'{nx} {ny} {nz}\n')
+        for s in np.linspace(0, 1, nz)**1.5:
+            for values in (x, y, ground + (1000 - ground)*s):
+                flat = values.reshape(-1)
+                for row in range(0, flat.size, 5):
+                    xyz.write(' '.join(f'{value:.6f}' for value in flat[row:row + 5]) + '\n')
+
+
+@pytest.fixture
+def cache_folder(tmp_path: Path) -> Path:
+    """ A cache with the sectors 000 and 090 """
+    folder = tmp_path / 'my_documentation'
+    write_sector(folder, '000', seed=0)
+    write_sector(folder, '090', seed=1)
+    return folder
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# tests/test_compare.py
+
+"""
+Comparison of two converted sectors, fields that were not compared to the end must not pass.
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from visualizations.analysis.compare import compare_files
+
+from conftest import FIELD_NAMES, write_sector
+
+
+@pytest.fixture
+def sectors(tmp_path: Path):
+    """ The same sector twice, in b UCRT differs in the slab z=1 """
+    write_sector(tmp_path / 'a', '000')
+    write_sector(tmp_path / 'b', '000')
+    path = tmp_path / 'b' / '000.phi.npz'
+    with np.load(path) as npz:
+        data = npz['data'].copy()
+    data[FIELD_NAMES.index('UCRT'), 1, 2, 3] += 1
+    np.savez_compressed(path, data=data, headers=FIELD_NAMES)
+    return tmp_path / 'a' / '000.phi.npz', path
+
+
+def test_compare(sectors):
+    result = compare_files(*sectors, rtol=1e-6)
+    assert not result.ok and not result.stopped_early
+    assert result.fields['UCRT'].ok is False
+    assert result.fields['UCRT'].violations == 1
+    assert result.fields['UCRT'].location == (1, 2, 3)
+    assert all(result.fields[name.strip()].ok is True for name in FIELD_NAMES if name != 'UCRT')
+
+
+def test_fail_fast_does_not_pass_unchecked_fields(sectors):
+    result = compare_files(*sectors, rtol=1e-6, fail_fast=True)
+    assert result.stopped_early and not result.ok
+    # the fields are streamed field by field, P1 is done before UCRT
+    assert result.fields['P1'].ok is True
+    assert result.fields['UCRT'].ok is False
+    for name in ('VCRT', 'WCRT', 'KE', 'EP'):
+        assert result.fields[name].ok is None
+        assert not result.fields[name].compared
+        assert 'not compared' in repr(result.fields[name])
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# tests/test_grid_store.py
+
+"""
+The lock of the grid store: a lock left by a killed process is taken over, a long conversion keeps its lock.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from visualizations.readers import grid_store
+from visualizations.readers.grid_store import GridStore, hash_file
+
+from conftest import write_xyz
+
+
+@pytest.fixture
+def xyz(tmp_path: Path) -> Path:
+    path = tmp_path / '000.xyz'
+    write_xyz(path)
+    return path
+
+
+def test_stale_lock_is_taken_over(tmp_path: Path, xyz: Path):
+    store = GridStore(tmp_path / 'grids')
+    store.folder.mkdir()
+    grid_hash = hash_file(xyz)
+    lock = store.lock_path(grid_hash)
+    lock.touch()
+    old = time.time() - 120
+    os.utime(lock, (old, old))
+    assert store.add(xyz, poll_interval=0.01, stale_after=60) == grid_hash
+    assert grid_hash in store
+    assert not lock.exists()
+    assert list(store.folder.glob('*.stale')) == []
+
+
+def test_fresh_lock_is_waited_for(tmp_path: Path, xyz: Path):
+    store = GridStore(tmp_path / 'grids')
+    store.folder.mkdir()
+    grid_hash = hash_file(xyz)
+    store.lock_path(grid_hash).touch()
+    waiter = threading.Thread(target=store.add, args=(xyz,), kwargs=dict(poll_interval=0.01, stale_after=60))
+    waiter.start()
+    time.sleep(0.2)
+    assert waiter.is_alive() and grid_hash not in store
+    store.lock_path(grid_hash).unlink()
+    waiter.join(10)
+    assert grid_hash in store
+
+
+def test_long_conversion_keeps_its_lock(tmp_path: Path, xyz: Path, monkeypatch):
+    """ A conversion taking several times stale_after is not taken over by a second process, the grid is parsed once """
+    reads = []
+    read = grid_store.Grid.read
+
+    def slow_read(grid, path):
+        reads.append(path)
+        time.sleep(1.0)
+        return read(grid, path)
+
+    monkeypatch.setattr(grid_store.Grid, 'read', slow_read)
+    stale_after = 0.2
+    first = threading.Thread(target=GridStore(tmp_path / 'grids').add, args=(xyz,), kwargs=dict(poll_interval=0.01, stale_after=stale_after))
+    first.start()
+    time.sleep(0.1)
+    second = threading.Thread(target=GridStore(tmp_path / 'grids').add, args=(xyz,), kwargs=dict(poll_interval=0.01, stale_after=stale_after))
+    second.start()
+    first.join(10)
+    second.join(10)
+    assert len(reads) == 1
+    assert hash_file(xyz) in GridStore(tmp_path / 'grids')
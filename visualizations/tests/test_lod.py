@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# tests/test_lod.py
+
+"""
+The levels of detail of the 3D views, the terrain budget counts the points of the surface.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('pyvista')
+
+from visualizations.lod import LevelOfDetail
+
+
+@pytest.fixture
+def lod() -> LevelOfDetail:
+    nx, ny, nz = 200, 160, 20
+    x, y, z = np.meshgrid(np.linspace(0, 2000, nx), np.linspace(0, 1600, ny), np.linspace(0, 1000, nz), indexing='ij')
+    return LevelOfDetail(np.stack([x, y, z + 0.05*x], axis=-1))
+
+
+@pytest.mark.parametrize('max_points', [100, 2_000, 10_000, 40_000, 1_000_000])
+def test_terrain_level_within_budget(lod: LevelOfDetail, max_points: int):
+    level = lod.level_below(max_points, terrain=True)
+    assert lod.terrains[level].n_points == lod.n_terrain_points(level)
+    if lod.n_terrain_points(lod.coarsest) <= max_points:
+        assert lod.n_terrain_points(level) <= max_points
+    # the next finer level would exceed the budget
+    if level > 0:
+        assert lod.n_terrain_points(level - 1) > max_points
+
+
+def test_terrain_is_not_decimated_by_the_vertical_nodes(lod: LevelOfDetail):
+    # 32 000 surface points fit, while the field grid has 640 000 nodes
+    assert lod.level_below(40_000, terrain=True) == 0
+    assert lod.level_below(40_000) > 0
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python
+# tests/test_server.py
+
+"""
+The slice service on a free port, asked like a dashboard would with http.client.
+"""
+import asyncio
+import http.client
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from visualizations.readers.cache import SectorCache
+from visualizations.server import SliceServer
+
+
+@pytest.fixture
+def server(cache_folder: Path):
+    server = SliceServer(SectorCache(cache_folder))
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    async def serve():
+        try:
+            await server.serve('127.0.0.1', 0, started)
+        except asyncio.CancelledError:
+            pass
+
+    task = loop.create_task(serve())
+    thread = threading.Thread(target=loop.run_until_complete, args=(task,), daemon=True)
+    thread.start()
+    assert started.wait(10)
+    yield server
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(10)
+    loop.close()
+
+
+def get(server: SliceServer, path: str):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=10)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def as_array(headers, body: bytes) -> np.ndarray:
+    shape = tuple(int(size) for size in headers['X-Shape'].split(','))
+    return np.frombuffer(body, dtype=headers['X-Dtype']).reshape(shape)
+
+
+def test_sectors(server):
+    status, _, body = get(server, '/sectors')
+    assert status == 200
+    assert json.loads(body) == ['000', '090']
+    status, _, body = get(server, '/sectors/090')
+    assert status == 200
+    metadata = json.loads(body)
+    assert metadata['shape'] == {'z': 5, 'x': 8, 'y': 6}
+    assert 'KE' in metadata['stored']
+
+
+def test_slices(server):
+    status, headers, body = get(server, '/sectors/000/KE/horizontal?height=50')
+    assert status == 200 and headers['X-Cache'] == 'miss'
+    assert as_array(headers, body).shape == (8, 6)
+    # the same field with the padding of the phi file is the same cached response
+    status, headers, again = get(server, '/sectors/000/KE%20%20/horizontal?height=50')
+    assert status == 200 and headers['X-Cache'] == 'hit' and again == body
+    status, headers, body = get(server, '/sectors/000/UCRT/vertical?x0=50&y0=50&x1=600&y1=400&n=7')
+    assert status == 200 and as_array(headers, body).shape == (2, 7, 5)
+    status, headers, body = get(server, '/sectors/090/speed/profile?x=300&y=200')
+    assert status == 200 and as_array(headers, body).shape == (2, 5)
+
+
+def test_sector_added_after_start(server, cache_folder: Path):
+    from conftest import write_sector
+
+    assert get(server, '/sectors/180')[0] == 404
+    write_sector(cache_folder, '180')
+    assert get(server, '/sectors/180/KE/horizontal?height=50')[0] == 200
+
+
+@pytest.mark.parametrize('path, status', [
+    ('/sectors/270', 404),
+    ('/sectors/..%2F..%2Fetc/KE/horizontal?height=50', 404),
+    ('/sectors/000/NOPE/horizontal?height=50', 404),
+    ('/sectors/000/KE/diagonal', 404),
+    ('/sectors/000/KE/horizontal', 400),
+    ('/sectors/000/KE/horizontal?height=abc', 400),
+    ('/sectors/000/KE/horizontal?height=nan', 400),
+    ('/sectors/000/KE/vertical?x0=0&y0=0&x1=1&y1=1&n=inf', 400),
+    ('/sectors/000/KE/vertical?x0=0&y0=0&x1=1&y1=1&n=0', 400),
+    ('/sectors/000/KE/profile?x=-inf&y=0', 400),
+    ('/other', 404),
+])
+def test_errors(server, path: str, status: int):
+    code, headers, body = get(server, path)
+    assert code == status
+    assert 'error' in json.loads(body)
+
+
+def test_known_sectors_are_not_listed_again(server, monkeypatch):
+    get(server, '/sectors/000/KE/horizontal?height=80')
+    calls = []
+    listing = server.cache.sectors
+    monkeypatch.setattr(server.cache, 'sectors', lambda: calls.append(1) or listing())
+    for height in (80, 80, 90):
+        assert get(server, f'/sectors/000/KE/horizontal?height={height}')[0] == 200
+    assert calls == []
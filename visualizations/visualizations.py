@@ -15,27 +15,25 @@ For Visual Studio Code use launch.json
 @author: kklee & gvk
 """
 from pathlib import Path
-from mpl_toolkits import mplot3d
-import matplotlib.pyplot as plt
+from typing import TYPE_CHECKING, Optional
 import numpy as np
-import pyvista as pv
-from pyvista import Plotter
 
 from .readers.xyz_reader import Grid
 from .readers.phi_reader import Phi
+from .readers.fields import FieldRegistry
+from .analysis.interpolation import InterpolationOperator, Transect
+from .backends import pyplot, pyvista
+from .lod import LevelOfDetail
 
-
-import matplotlib.animation as animation
-from matplotlib.widgets import Slider
-
-pv.global_theme.axes.box = True
-pv.global_theme.axes.show = True
+if TYPE_CHECKING:
+    from pyvista import Plotter
 
 class Slicer():
     def __init__(self, coord: Path, phi: Path, var: str='VCRT'):
         self.coord = np.load(coord)['coord_centered']
         self.phi = np.load(phi)
-        self.fig, self.ax = plt.subplots()
+        self.fields = FieldRegistry.from_npz(self.phi)
+        self.fig, self.ax = pyplot().subplots()
         self.field = self.get_field(var).T
         self.X = self.coord[:,:,:,0] 
         self.Y = self.coord[:,:,:,1] 
@@ -53,15 +51,11 @@ class Slicer():
 
 
     def get_field(self, var: str):
-        try:
-            field = self.phi['data'][np.nonzero(self.phi['headers'] == var)[0][0]]
-            field = field.transpose(0,2,1)
-        except IndexError: 
-            exit(f"Exiting: No data found: Possible variables from phi file: {self.phi['headers']}")
-        return field
+        return self.fields[var].transpose(0,2,1)
     
     def _slider(self):
-        axamp = plt.axes([0.2, .03, 0.50, 0.02])
+        from matplotlib.widgets import Slider
+        axamp = pyplot().axes([0.2, .03, 0.50, 0.02])
         if self.plane=='x':
             self.samp = Slider(axamp, 'Meter', 0, self.X.shape[1]-1, valinit=0)
         elif self.plane =='y':
@@ -123,12 +117,28 @@ class Slicer():
 
 
 
+def plot_transect(transect: Transect, operator: InterpolationOperator, field: np.ndarray, var: str=''):
+    # the operator is compiled once per grid, see analysis/interpolation.py, so other fields and sectors are only a gather
+    values = operator(field)
+    z = operator.points[:,2].reshape(operator.shape)
+    distance = np.broadcast_to(transect.distance()[:,None], operator.shape)
+    fig, ax = pyplot().subplots()
+    ax.set_title('Transect of '+var)
+    ax.set_xlabel('Distance along the transect')
+    ax.set_ylabel('z')
+    label = ax.contourf(distance, z, values)
+    cbar = fig.colorbar(label)
+    cbar.ax.set_ylabel(var)
+    return fig, ax
+
+
 class Visualizator():
     def __init__(self, coords: Path, ):
         self.path = coords
 
     def elevation(self):
         coord = np.load(self.path /'coord_file.npz')['coord_centered']
+        plt = pyplot()
         fig,ax=plt.subplots(figsize=(14,14))
         ax.set_title('Terrain')
         ax.set_xlabel('x')
@@ -140,18 +150,14 @@ class Visualizator():
 
 
 
-    def slice3D(self, variable: str, plotter: Plotter):
-        fields = np.load(temp_folder / 'phi_file.npz')
+    def slice3D(self, variable: str, plotter: 'Plotter'):
+        fields = FieldRegistry.from_npz(np.load(temp_folder / 'phi_file.npz'))
         coord = np.load(self.path /'coord_file.npz')['coord_centered']
 
-        try:
-            field = fields['data'][np.nonzero(fields['headers'] == variable)[0][0]]
-            field = field.transpose(0,2,1)
-            print(field.shape)
-        except IndexError: 
-            exit(f"Exiting: No data found: Possible variables from phi file: {fields['headers']}")
+        field = fields[variable].transpose(0,2,1)
+        print(field.shape)
         
-        grid = pv.StructuredGrid(coord[:,:,:,0], coord[:,:,:,1], coord[:,:,:,2]*7)
+        grid = pyvista().StructuredGrid(coord[:,:,:,0], coord[:,:,:,1], coord[:,:,:,2]*7)
         grid[variable] = field.flatten()
         plotter.add_mesh_slice(grid)
         return plotter
@@ -159,34 +165,28 @@ class Visualizator():
 class Slicer3D:
     def __init__(self, coord_path: Path, phi_path: Path):
         self.coords = np.load(coord_path)['coord_centered']
-        self.fields = np.load(phi_path)
+        self.fields = FieldRegistry.from_npz(np.load(phi_path))
         self.field = self._field()
-        self.field_grid = pv.StructuredGrid(self.coords[:,:,:,0], self.coords[:,:,:,1], self.coords[:,:,:,2]*7)
+        self.field_grid = pyvista().StructuredGrid(self.coords[:,:,:,0], self.coords[:,:,:,1], self.coords[:,:,:,2]*7)
+        self.lod = LevelOfDetail(self.coords, full=self.field_grid, z_scale=7)
 
     def initiate_plotter(self):
-        plotter = pv.Plotter(notebook=False, )
+        plotter = pyvista().Plotter(notebook=False, )
         return plotter
     
-    def elevation3D(self, plotter: Plotter):
-        coords = self.coords
-
-        ground = pv.StructuredGrid(coords[:,:,0,0], coords[:,:,0,1], coords[:,:,0,2]*7)
-        ground['Elevation'] = ground.points[:,2]
+    def elevation3D(self, plotter: 'Plotter', max_points: int=1_000_000):
+        # The terrain is static, so the finest decimated copy within the budget is used for the whole session
+        ground = self.lod.terrains[self.lod.level_below(max_points, terrain=True)]
         plotter.add_mesh(ground, scalars=ground['Elevation'], cmap='gist_earth', name='Terrain')#, show_edges=True)
 
         return plotter
     
     def _field(self, variable: str='VCRT'):
-        try:
-            field = self.fields['data'][np.nonzero(self.fields['headers'] == variable)[0][0]]
-            field = field.transpose(0,2,1)
-        except IndexError: 
-            exit(f"Exiting: No data found: Possible variables from phi file: {self.fields['headers']}")
-        return field
+        return self.fields[variable].transpose(0,2,1)
     
     def _set_field_grid_variable(self, variable: str= 'VCRT'):
         self.field = self._field(variable)
-        self.field_grid[variable] = self.field.flatten()
+        self.lod.set_field(variable, self.field.T)
 
 
     
@@ -199,8 +199,9 @@ class Slicer3D:
 
 
 class Slice():
-    def __init__(self, mesh):
+    def __init__(self, mesh, lod: Optional[LevelOfDetail]=None):
         self.mesh = mesh
+        self.lod = lod
         self.output = self.mesh.slice()  # Expected PyVista mesh type
         # default parameters
         self.center = self.mesh.center
@@ -209,18 +210,30 @@ class Slice():
             }
 
     def __call__(self, param, value):
+        # Called while the slider is dragged, so the coarsest level is used to keep up with the slider
         self.kwargs[param] = value
-        self.update()
+        self.update(level=self.lod.coarsest if self.lod else 0)
+
+    def refine(self, *args):
+        # Called when the interaction stops, swaps in the full resolution slice
+        self.update(level=0)
 
-    def update(self):
+    def update(self, level: int=0):
         # This is where you call your simulation
-        print(self.kwargs)
-        result = self.mesh.slice(origin=(self.mesh.center[0], self.kwargs['cell'], self.mesh.center[2]), normal='y')
+        print(self.kwargs, f'level: {level}')
+        origin = (self.mesh.center[0], self.kwargs['cell'], self.mesh.center[2])
+        if self.lod:
+            result = self.lod.slice(level, origin=origin, normal='y')
+        else:
+            result = self.mesh.slice(origin=origin, normal='y')
         self.output.copy_from(result)
         return
 
 
 if __name__ == "__main__":
+    import matplotlib.animation as animation
+    plt = pyplot()
+
     # Prepare and unzip
     base = Path('C:/Users/GullikKillie/Documents/WindSim Projects 12/patagonia-2024-06-12T080332/')
     project_path = base
@@ -255,10 +268,10 @@ if __name__ == "__main__":
     plotter = slicer3D.elevation3D(plotter)
     # plotter = slicer3D.draggable_slice('TEM1', plotter)
     slicer3D._set_field_grid_variable('VCRT')
-    slice = Slice(slicer3D.field_grid)
+    slice = Slice(slicer3D.field_grid, lod=slicer3D.lod)
     print(slicer3D.field_grid.bounds)
     plotter.add_mesh(slice.output)
-    plotter.add_slider_widget(
+    slider = plotter.add_slider_widget(
         callback=lambda value: slice('cell', int(value)),
         rng=[slicer3D.field_grid.bounds[0], slicer3D.field_grid.bounds[1]],
         value=30,
@@ -266,7 +279,9 @@ if __name__ == "__main__":
         pointa=(0.025, 0.1),
         pointb=(0.31, 0.1),
         style='modern',
+        interaction_event='always',
     )
+    slider.AddObserver('EndInteractionEvent', slice.refine)
 
     plotter.show()
 